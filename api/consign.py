@@ -1,155 +1,354 @@
-from asyncio import sleep
+import time
+from asyncio import gather, wait_for, create_task, shield, to_thread, Semaphore, Task
+from multiprocessing.connection import Connection
 from random import randint
+from typing import Awaitable, Coroutine
 
-from noble_tls import Session
 from requests import Response
 
-from api.seller import Seller
+from api.seller import Seller, API_URL
 from models.wtn import Consign, Product
+from utils import decode
+from utils.cache import VariantCache
+from utils.diff import ConsignDiff, ConsignEvent, ConsignAdded, ConsignChanged, ConsignRemoved
+from utils.fingerprint import Fingerprint
+from utils.http import HttpClient
 from utils.log import Log
-from utils.proxy import Proxies
+from utils.metrics import DETECTION_TO_ACTION
+from utils.paginator import Paginator, PageError
+from utils.retry import ProxyError, RequestTimeout, ACTION_POLICY, DEFAULT_POLICY, expect
+from utils.scheduler import PollScheduler
+from utils.store import StateStore, SUCCESS, FAILURE
 from utils.webhook import WebHook
 
-URL_CONSIGN_ALL: str = 'https://api-sell.wethenew.com/consignment-slots'
-URL_PLACE_CONSIGN: str = 'https://api-sell.wethenew.com/consignments'
+URL_CONSIGN_ALL: str = f'{API_URL}/consignment-slots'
+URL_PLACE_CONSIGN: str = f'{API_URL}/consignments'
+PREFETCH_CONCURRENCY: int = 2
+
+
+def seller_log(seller: Seller) -> Log:
+    return Log.get('Consign', seller.log_level, seller.log.task_number)
 
 
 class ConsignManager:
 
-    def __init__(self, sellers: list[Seller]):
+    def __init__(self, sellers: list[Seller], store: StateStore | None = None, events: Connection | None = None):
         self.sellers: list[Seller] = sellers
         r_seller: Seller = sellers[randint(0, len(sellers) - 1)]
 
-        self.log: Log = Log('Consign', r_seller.log_level)
+        self.log: Log = Log.get('Consign', r_seller.log_level)
 
-        self.s: Session = r_seller.s
-        self.proxies: Proxies = r_seller.proxies
-        self.delay: float = r_seller.delay
+        self.poller: Seller = r_seller
+        self.scheduler: PollScheduler = PollScheduler(
+            r_seller.delay, r_seller.delay_min, r_seller.delay_max, name='consign'
+        )
+        self.timeout: float = r_seller.timeout * 2
         self.webhook_m: WebHook = WebHook(r_seller.webhook_m)
         self.webhook_s: WebHook = WebHook(r_seller.webhook_s)
 
-        self.consign_seen: set[Consign] = set[Consign]()
+        self.consign_diff: ConsignDiff = ConsignDiff()
+        self.fingerprint: Fingerprint = Fingerprint('consign')
+        self.store: StateStore | None = store
+        self.events: Connection | None = events
+        self.background_tasks: set[Task] = set[Task]()
+
+        self.variants: VariantCache = VariantCache(r_seller.variant_cache, ttl=r_seller.variant_ttl)
+        self.variant_fetches: dict[int, Task] = {}
+        self.prefetch_semaphore: Semaphore = Semaphore(PREFETCH_CONCURRENCY)
+
+    @property
+    def http(self) -> HttpClient:
+        # Polls go through one seller, picked again once a reload stopped it or replaced it with new credentials
+        if self.poller not in self.sellers and self.sellers:
+            self.poller = self.sellers[randint(0, len(self.sellers) - 1)]
+            self.log.info(f'Polling consigns with account {self.poller.email}')
+        return self.poller.http
+
+    def _fetch_consigns(self, params: dict) -> Awaitable[Response]:
+        params['nocache'] = randint(0, 999999999)
+        return self.http.get(url=URL_CONSIGN_ALL, params=params)
 
     async def monitor_consigns(self) -> None:
         first_run: bool = True
+        if self.store and self.store.slots:
+            self.consign_diff.reset(self.store.slots)
+            for slot in self.store.slots:
+                self._prefetch_variants(slot['id'])
+            first_run = False
+            self.log.debug(f'Resuming from {len(self.store.slots)} stored consigns')
+
         while True:
-            await sleep(self.delay)
+            await self.scheduler.wait()
             try:
-                params: dict = {'take': '100', 'nocache': randint(0, 999999999)}
-                r: Response = await self.s.get(url=URL_CONSIGN_ALL, params=params, proxy=self.proxies.random)
-
-                if r.status_code == 200:
-                    current_consigns: set[Consign] = set[Consign]([Consign(
-                        brand=result['brand'],
-                        name=result['name'],
-                        id=result['id'],
-                        sizes=result['sizes'],
-                        image=result['image'],
-                    ) for result in r.json()['results']])
-
-                    if first_run:
-                        self.consign_seen = current_consigns
-                        first_run = False
-                        self.log.debug('Initial consigns fetched, monitoring...')
-                        continue
-                    else:
-                        for consign in current_consigns:
-                            if consign in self.consign_seen:
-                                existing_consign = next((c for c in self.consign_seen if c == consign), None)
-                                if existing_consign and existing_consign.sizes != consign.sizes:
-                                    added_sizes = set(consign.sizes) - set(existing_consign.sizes)
-                                    removed_sizes = set(existing_consign.sizes) - set(consign.sizes)
-                                    if added_sizes:
-                                        self.log.info(f'New size: {consign}')
-                                        await self._place_consignment(consign.name, consign.id, added_sizes)
-                                        self.webhook_m.send_consign(consign, added_sizes)
-                                    if removed_sizes:
-                                        self.log.debug(f'Deleted size: {consign}')
-                                    self.consign_seen.remove(existing_consign)
-                                    self.consign_seen.add(consign)
-                            else:
-                                self.log.info(f'New consign: {consign}')
-                                await self._place_consignment(consign.name, consign.id, set(consign.sizes))
-                                self.consign_seen.add(consign)
-                                self.webhook_m.send_consign(consign, set(consign.sizes))
-                        for consign in self.consign_seen - current_consigns:
-                            self.log.debug(f'Consign removed: {consign}')
-                            self.consign_seen.remove(consign)
-
-                        cache: str = '' if r.headers['Cf-Cache-Status'] == 'MISS' else ' (cached)'
-                        self.log.debug(f'Monitoring consigns{cache} [{len(self.consign_seen)} items]')
+                paginator: Paginator = Paginator(self._fetch_consigns, fingerprint=self.fingerprint)
 
-                else:
-                    self.log.error(f'Error while monitoring consigns: {r.status_code}')
+                if first_run:
+                    results: list[dict] = await paginator.all()
+                    self.consign_diff.reset(results)
+                    for result in results:
+                        self._prefetch_variants(result['id'])
+                    first_run = False
+                    self._save_slots()
+                    self.log.debug('Initial consigns fetched, monitoring...')
                     continue
 
-            except Exception as e:
-                if 'Client.Timeout exceeded' in str(e):
-                    self.log.warning('TLSClientException (timeout), retrying...')
-                elif 'Proxy responded with non 200 code' in str(e):
-                    self.log.warning('Proxy responded with non 200 code, retrying...')
+                events: list[ConsignEvent] = []
+                unchanged: list[list[dict]] | None = []
+                try:
+                    async for results in paginator.pages():
+                        if not paginator.changed:
+                            unchanged.append(results)
+                            continue
+                        if unchanged is not None:
+                            self.consign_diff.begin()
+                            for page in unchanged:
+                                self.consign_diff.feed(page)
+                            unchanged = None
+                        detected_at: float = time.perf_counter()
+                        for event in self.consign_diff.feed(results):
+                            events.append(event)
+                            self._dispatch(event, detected_at)
+                    if unchanged is not None and paginator.changed:
+                        # Emptied pages are never yielded, the slots they held are only found missing by finish
+                        self.consign_diff.begin()
+                        for page in unchanged:
+                            self.consign_diff.feed(page)
+                        unchanged = None
+                except BaseException:
+                    if unchanged is None:
+                        self.consign_diff.abort()
+                    self.fingerprint.reset()
+                    raise
+                if unchanged is None:
+                    for event in self.consign_diff.finish():
+                        events.append(event)
+                        self._dispatch(event)
                 else:
-                    self.log.error(f'Error while monitoring consigns: {e}')
+                    self.fingerprint.skip()
+                if events:
+                    self._save_slots(events)
 
-    async def _place_consignment(self, name: str, c_id: int, sizes: set[str]) -> None:
-        new_products: list[Product] = [Product(name, size) for size in sizes]
-        for product in new_products:
-            for seller in self.sellers:
-                s_log: Log = Log(f'Consign', seller.log_level, seller.log.task_number)
-                if product in seller.listing:
-                    url_product: str = f'https://api-sell.wethenew.com/products/{c_id}/consignments'
-                    try:
-                        r: Response = await seller.s.get(url=url_product, proxy=self.proxies.random)
-                        if r.status_code != 200:
-                            s_log.error(f'Error while fetching consignments: {r.status_code}')
-                            continue
+                cache_status: str | None = paginator.first.headers.get('Cf-Cache-Status')
+                self.scheduler.feedback(changed=bool(events), cached=cache_status == 'HIT')
+                cache: str = '' if cache_status == 'MISS' else ' (cached)'
+                self.log.debug('Monitoring consigns%s [%d items]', cache, len(self.consign_diff))
+
+            except PageError as e:
+                self.scheduler.feedback(error=True)
+                self.log.error(f'Error while monitoring consigns: {e.status_code}')
+
+            except RequestTimeout:
+                self.scheduler.feedback(error=True)
+                self.log.warning('Request timed out, retrying...')
+
+            except ProxyError:
+                self.scheduler.feedback(error=True)
+                self.log.warning('Proxy responded with non 200 code, retrying...')
+
+            except Exception as e:
+                self.scheduler.feedback(error=True)
+                self.log.error(f'Error while monitoring consigns: {e}')
+
+    async def listen_consigns(self) -> None:
+        while True:
+            try:
+                event, detected_at = await to_thread(self.events.recv)
+            except (EOFError, OSError):
+                self.log.critical('Lost the connection to the supervisor, no more consign events')
+                return
+            self._run_in_background(self._handle_event_safely(event, detected_at, announce=False))
+
+    def _dispatch(self, event: ConsignEvent, detected_at: float | None = None) -> None:
+        # Only the diff is sequential, placements of a burst run side by side and never hold up the next poll
+        if self.events is not None:
+            try:
+                self.events.send((event, detected_at))
+            except (OSError, ValueError) as e:
+                self.log.error(f'Error while publishing consign event: {e}')
+        self._run_in_background(self._handle_event_safely(event, detected_at))
+
+    async def _handle_event_safely(
+            self, event: ConsignEvent, detected_at: float | None = None, announce: bool = True
+    ) -> None:
+        try:
+            await self._handle_event(event, detected_at, announce)
+        except Exception as e:
+            self.log.error(f'Error while handling consign event for {event.consign}: {e}')
 
-                        v_id: int = next(
-                            (v['id'] for v in r.json()['variants'] if v['europeanSize'] == product.size),
-                            None
-                        )
-
-                        for p in seller.listing:
-                            if p == product:
-                                product.brand = p.brand
-                                product.image = p.image
-                                product.price = p.price
-                                product.id = p.id
-                                break
-
-                        data: dict = {
-                            'consignments': [
-                                {
-                                    'quantity': 1,
-                                    'variantId': v_id,
-                                    'price': product.price,
-                                    'paymentOptionType': 'STANDARD',
-                                },
-                            ],
-                            'paymentInfoUuid': seller.payment_uuid,
-                            'addressUuid': seller.address_uuid,
-                            'isTermsAndConditionsAccepted': True,
-                            'isDepositConditionsAccepted': True,
-                        }
-                        r: Response = await seller.s.post(url=URL_PLACE_CONSIGN, json=data, proxy=self.proxies.random)
-                        if r.status_code == 201:
-                            s_log.success(f'Consigned {product}')
-                            await self._delete_listing(seller, product)
-                            self.webhook_s.send_accept_consign(product)
-                        else:
-                            s_log.error(f'Error while consigning {product}: {r.status_code}')
-
-                    except Exception as e:
-                        s_log.error(f'Error while consigning {product}: {e}')
+    def _save_slots(self, events: list[ConsignEvent] | None = None) -> None:
+        # A poll only writes the slots its events touched, the whole table is written once after the first fetch
+        if not self.store:
+            return
+        if events is None:
+            self.store.save_slots(self.consign_diff.snapshot())
+            return
+        self.store.update_slots(
+            [event.consign for event in events if not isinstance(event, ConsignRemoved)],
+            [event.consign.id for event in events if isinstance(event, ConsignRemoved)]
+        )
+
+    async def _handle_event(
+            self, event: ConsignEvent, detected_at: float | None = None, announce: bool = True
+    ) -> None:
+        consign: Consign = event.consign
+        if isinstance(event, ConsignAdded):
+            if announce:
+                self.log.info(f'New consign: {consign}')
+            self._prefetch_variants(consign.id)
+            await self._place_consignment(consign.name, consign.id, set(consign.sizes), detected_at)
+            if announce:
+                self.webhook_m.send_consign(consign, set(consign.sizes))
+        elif isinstance(event, ConsignChanged):
+            if event.added_sizes:
+                if announce:
+                    self.log.info(f'New size: {consign}')
+                await self._place_consignment(consign.name, consign.id, set(event.added_sizes), detected_at)
+                if announce:
+                    self.webhook_m.send_consign(consign, set(event.added_sizes))
+            if event.removed_sizes and announce:
+                self.log.debug('Deleted size: %s', consign)
+        elif isinstance(event, ConsignRemoved) and announce:
+            self.log.debug('Consign removed: %s', consign)
+
+    async def _place_consignment(
+            self, name: str, c_id: int, sizes: set[str], detected_at: float | None = None
+    ) -> dict[str, int]:
+        placements: list[tuple[str, Coroutine]] = []
+        for size in sizes:
+            for seller in self.sellers:
+                product: Product | None = seller.listing.find(name, size)
+                if product is not None:
+                    placements.append((size, self._consign(seller, c_id, product, detected_at)))
                 else:
-                    s_log.debug(f'{product} is not in your listing, cannot consign')
+                    seller_log(seller).debug('%s is not in your listing, cannot consign', Product(name, size))
+
+        results: list[bool] = await gather(*(placement for _, placement in placements))
+        placed: dict[str, int] = dict.fromkeys(sizes, 0)
+        for (size, _), result in zip(placements, results):
+            placed[size] += result
+        if placements:
+            self.log.info(f'Placed {sum(results)}/{len(placements)} consignments for {name}')
+        return placed
+
+    async def _consign(self, seller: Seller, c_id: int, product: Product, detected_at: float | None) -> bool:
+        s_log: Log = seller_log(seller)
+        if self.store and self.store.has_succeeded('consign', product.id):
+            s_log.debug('%s was already consigned, skipping', product)
+            seller.consume(product)
+            return False
+
+        error: str = ''
+        async with seller.consign_semaphore, seller.action():
+            try:
+                if await wait_for(self._post_consignment(seller, s_log, c_id, product, detected_at), self.timeout):
+                    self._record(seller, c_id, product, SUCCESS)
+                    return True
+            except TimeoutError:
+                s_log.error(f'Timeout while consigning {product}')
+                error = 'timeout'
+            except Exception as e:
+                s_log.error(f'Error while consigning {product}: {e}')
+                error = str(e)
+        self._record(seller, c_id, product, FAILURE, error)
+        return False
+
+    def _record(self, seller: Seller, c_id: int, product: Product, outcome: str, detail: str = '') -> None:
+        if self.store:
+            detail = f'{c_id} {product.size} {detail}'.strip()
+            self.store.record_action('consign', product.id, seller.log.task_number, outcome, detail)
+
+    async def _post_consignment(
+            self, seller: Seller, s_log: Log, c_id: int, product: Product, detected_at: float | None
+    ) -> bool:
+        v_id: int | None = (await self._get_variants(seller.http, c_id)).get(product.size)
+        if v_id is None:
+            v_id = (await self._get_variants(seller.http, c_id, refresh=True)).get(product.size)
+        if v_id is None:
+            s_log.error(f'Size {product.size} of {product} has no variant to consign')
+            return False
+
+        data: dict = {
+            'consignments': [
+                {
+                    'quantity': 1,
+                    'variantId': v_id,
+                    'price': product.price,
+                    'paymentOptionType': 'STANDARD',
+                },
+            ],
+            'paymentInfoUuid': seller.payment_uuid,
+            'addressUuid': seller.address_uuid,
+            'isTermsAndConditionsAccepted': True,
+            'isDepositConditionsAccepted': True,
+        }
+        if detected_at is not None:
+            DETECTION_TO_ACTION.observe(time.perf_counter() - detected_at, 'consign')
+        r: Response = await seller.http.post(url=URL_PLACE_CONSIGN, json=data)
+        if r.status_code != 201:
+            s_log.error(f'Error while consigning {product}: {r.status_code}')
+            return False
+
+        s_log.success(f'Consigned {product}')
+        seller.consume(product)
+        self._run_in_background(self._delete_listing(seller, product))
+        self.webhook_s.send_accept_consign(product)
+        return True
+
+    async def _get_variants(self, http: HttpClient, c_id: int, refresh: bool = False) -> dict[str, int]:
+        if not refresh:
+            variants: dict[str, int] | None = self.variants.get(c_id)
+            if variants is not None:
+                return variants
+
+        fetch: Task | None = self.variant_fetches.get(c_id)
+        if fetch is None:
+            fetch = create_task(self._fetch_variants(http, c_id))
+            self.variant_fetches[c_id] = fetch
+            fetch.add_done_callback(lambda _: self.variant_fetches.pop(c_id, None))
+        return await shield(fetch)
+
+    async def _fetch_variants(self, http: HttpClient, c_id: int) -> dict[str, int]:
+        url_product: str = f'{API_URL}/products/{c_id}/consignments'
+
+        async def fetch() -> Response:
+            r: Response = await http.get(url=url_product)
+            expect(r.status_code, 200, message=f'Error while fetching consignments: {r.status_code}')
+            return r
+
+        r: Response = await ACTION_POLICY.run(fetch, url_product)
+
+        variants: dict[str, int] = decode.variants(decode.body(r))
+        self.variants.set(c_id, variants)
+        self._run_in_background(self.variants.save())
+        return variants
+
+    def _prefetch_variants(self, c_id: int) -> None:
+        if c_id in self.variants or c_id in self.variant_fetches:
+            return
+
+        async def prefetch():
+            async with self.prefetch_semaphore:
+                try:
+                    await self._get_variants(self.http, c_id)
+                except Exception as e:
+                    self.log.debug(f'Failed to prefetch variants of {c_id}: {e}')
+
+        self._run_in_background(prefetch())
+
+    def _run_in_background(self, coro: Coroutine) -> None:
+        task: Task = create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
 
     async def _delete_listing(self, seller: Seller, product: Product) -> None:
+        seller.consume(product)
+        url_product: str = f'{API_URL}/listings/{product.id}'
+
+        async def delete():
+            r: Response = await seller.http.delete(url=url_product)
+            expect(r.status_code, 200, 404)
+
         try:
-            url_product: str = f'https://api-sell.wethenew.com/listings/{product.id}'
-            r: Response = await seller.s.delete(url=url_product, proxy=self.proxies.random)
-            if r.status_code != 200:
-                await sleep(self.delay)
-                await self._delete_listing(seller, product)
+            await DEFAULT_POLICY.run(delete, url_product, log=seller_log(seller))
         except Exception as e:
             self.log.error(f'Error while deleting listing {product}: {e}')
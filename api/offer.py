@@ -1,90 +1,154 @@
-from asyncio import sleep
+import time
+from asyncio import create_task, Task
 from random import randint
+from typing import Awaitable
 
-from noble_tls import Session
 from requests import Response
 
-from api.seller import Seller
+from api.seller import Seller, SellerInitError, TokenBackoff, API_URL
 from models.wtn import Offer
+from utils import decode
+from utils.cache import TTLCache
+from utils.fingerprint import Fingerprint
+from utils.http import HttpClient
 from utils.log import Log
-from utils.proxy import Proxies
+from utils.metrics import DETECTION_TO_ACTION, OFFERS
+from utils.paginator import Paginator, PageError
+from utils.pricing import PricingRules
+from utils.retry import HttpError, ProxyError, RequestTimeout, ACTION_POLICY, expect
+from utils.scheduler import PollScheduler
+from utils.store import StateStore, SUCCESS, FAILURE
 from utils.webhook import WebHook
 
-URL_OFFERS: str = 'https://api-sell.wethenew.com/offers'
+URL_OFFERS: str = f'{API_URL}/offers'
+OFFER_DONE: set[str] = {'ACCEPTED', 'REFUSED'}
+COMPLETED_TTL: float = 3600
+OFFER_DEADLINE: float = 15
 
 
 class OfferManager:
-    def __init__(self, seller: Seller):
-        self.log: Log = Log('Offer', seller.log_level, task_number=seller.log.task_number)
+    def __init__(
+            self, seller: Seller, phase: float = 0, store: StateStore | None = None, pricing: PricingRules | None = None
+    ):
+        self.log: Log = Log.get('Offer', seller.log_level, task_number=seller.log.task_number)
 
-        self.s: Session = seller.s
-        self.proxies: Proxies = seller.proxies
-        self.delay: float = seller.delay
+        self.http: HttpClient = seller.http
+        self.scheduler: PollScheduler = PollScheduler(
+            seller.delay, seller.delay_min, seller.delay_max, phase, name='offer'
+        )
         self.webhook_s: WebHook = WebHook(seller.webhook_s)
 
         self.seller = seller
+        self.store: StateStore | None = store
+        self.pricing: PricingRules = pricing or PricingRules(None)
+        self.in_flight: dict[str, Task] = {}
+        self.completed: TTLCache = TTLCache(maxsize=4096, ttl=COMPLETED_TTL)
+        self.fingerprint: Fingerprint = Fingerprint('offer')
+
+    def _fetch_offers(self, params: dict) -> Awaitable[Response]:
+        params['nocache'] = randint(0, 999999999)
+        return self.http.get(url=URL_OFFERS, params=params)
 
     async def monitor_offers(self) -> None:
         while True:
-            await sleep(self.delay)
+            await self.scheduler.wait()
+            # Only the token this poll was sent with is refreshed, a 401 racing another refresh must not log in again
+            authorization: str | None = self.seller.s.headers.get('authorization')
             try:
-                params: dict = {'take': '100', 'nocache': randint(0, 999999999)}
-                r: Response = await self.s.get(url=URL_OFFERS, params=params, proxy=self.proxies.random)
-
-                if r.status_code == 200:
-                    data: dict = r.json()
-                    if not data.get('results'):
-                        self.log.debug('No new offers found, monitoring...')
-                    else:
-                        results: list = data['results']
+                paginator: Paginator = Paginator(self._fetch_offers, fingerprint=self.fingerprint)
+                found: int = 0
+                try:
+                    async for results in paginator.pages():
+                        if not paginator.changed:
+                            continue
+                        detected_at: float = time.perf_counter()
+                        offers: list[Offer] = []
                         for result in results:
-                            offer: Offer = Offer(
-                                id=result['id'],
-                                name=result['name'],
-                                variant_id=result['variantId'],
-                                sku=result['sku'],
-                                brand=result['brand'],
-                                image=result['image'],
-                                size=result['europeanSize'],
-                                listing_price=result['listingPrice'],
-                                price=result['price'],
-                                createTime=result['createTime'],
+                            o_id: str = result['id']
+                            if o_id in self.in_flight or o_id in self.completed:
+                                continue
+                            if self.store and self.store.offers.get(o_id) in OFFER_DONE:
+                                self.log.debug('Offer %s already handled, skipping', o_id)
+                                continue
+                            offer: Offer = decode.offer(result)
+                            self.log.success(f'New offer found: {offer}')
+                            offers.append(offer)
+
+                        # The deadline runs from detection, time spent queued for the semaphore counts against it
+                        deadline: float = time.monotonic() - (time.perf_counter() - detected_at) + OFFER_DEADLINE
+                        for offer, accept in zip(offers, self.pricing.decide(offers, self.seller.price_delta)):
+                            self.in_flight[offer.id] = create_task(
+                                self._handle_offer(offer, accept, detected_at, deadline)
                             )
+                        found += len(offers)
+                except BaseException:
+                    self.fingerprint.reset()
+                    raise
 
-                            self.log.success(f'New offer found: {offer}')
-                            is_acceptable: bool = offer.price >= offer.listing_price - self.seller.price_delta
-                            await self._accept_offer(offer) if is_acceptable else await self._refuse_offer(offer)
+                if not paginator.changed:
+                    self.fingerprint.skip()
+                cache_status: str | None = paginator.first.headers.get('Cf-Cache-Status')
+                self.scheduler.feedback(changed=found > 0, cached=cache_status == 'HIT')
+                if not found:
+                    self.log.debug('No new offers found, monitoring...')
 
-                elif r.status_code == 401:
+            except PageError as e:
+                self.scheduler.feedback(error=True)
+                if e.status_code == 401:
                     self.log.warning('Seller token expired, refreshing...')
-                    await self.seller.init()
+                    try:
+                        await self.seller.refresh(authorization)
+                    except TokenBackoff as error:
+                        self.log.debug(f'Not refreshing seller token: {error}')
+                    except SellerInitError as error:
+                        self.log.error(f'Failed to refresh seller token: {error}')
                 else:
-                    self.log.error(f'Error while fetching offers: {r.status_code}')
-                    continue
+                    self.log.error(f'Error while fetching offers: {e.status_code}')
+
+            except RequestTimeout:
+                self.scheduler.feedback(error=True)
+                self.log.warning('Request timed out, retrying...')
+
+            except ProxyError:
+                self.scheduler.feedback(error=True)
+                self.log.warning('Proxy responded with non 200 code, retrying...')
 
             except Exception as e:
-                if 'Client.Timeout exceeded' in str(e):
-                    self.log.warning('TLSClientException (timeout), retrying...')
-                elif 'Proxy responded with non 200 code' in str(e):
-                    self.log.warning('Proxy responded with non 200 code, retrying...')
-                else:
-                    self.log.error(f'Error while fetching offers: {e}')
+                self.scheduler.feedback(error=True)
+                self.log.error(f'Error while fetching offers: {e}')
+
+    async def _handle_offer(self, offer: Offer, accept: bool, detected_at: float, deadline: float) -> None:
+        try:
+            async with self.seller.offer_semaphore, self.seller.action():
+                DETECTION_TO_ACTION.observe(time.perf_counter() - detected_at, 'offer')
+                status: str = (
+                    await self._accept_offer(offer, deadline) if accept else await self._refuse_offer(offer, deadline)
+                )
+            OFFERS.inc(status)
+            if status in OFFER_DONE:
+                self.completed.set(offer.id, status)
+            else:
+                self.fingerprint.reset()
+        finally:
+            self.in_flight.pop(offer.id, None)
 
-    async def _accept_offer(self, offer: Offer) -> None:
+    async def _accept_offer(self, offer: Offer, deadline: float | None = None) -> str:
         try:
             self.log.info(f'Accepting offer {offer.id} ...')
             json: dict = {'name': offer.id, 'status': 'ACCEPTED', 'variantId': offer.variant_id}
-            r: Response = await self.seller.s.post(URL_OFFERS, json=json, proxy=self.proxies.random)
+            await self._post_offer(json, deadline)
 
-            if r.status_code == 201:
-                self.log.success(f'Offer {offer.id} accepted!')
-                self.webhook_s.send_accept_offer(offer)
-            else:
-                self.log.error(f'Error while accepting offer {offer.id}: {r.status_code}')
+            self.log.success(f'Offer {offer.id} accepted!')
+            self.webhook_s.send_accept_offer(offer)
+            return self._record(offer, 'ACCEPTED', SUCCESS)
+        except HttpError as e:
+            self.log.error(f'Error while accepting offer {offer.id}: {e.status_code}')
+            return self._record(offer, 'ACCEPT_FAILED', FAILURE, str(e.status_code))
         except Exception as e:
             self.log.error(f'Error while accepting offer {offer.id}: {e}')
+            return self._record(offer, 'ACCEPT_FAILED', FAILURE, str(e))
 
-    async def _refuse_offer(self, offer: Offer) -> None:
+    async def _refuse_offer(self, offer: Offer, deadline: float | None = None) -> str:
         try:
             self.log.info(f'Refusing offer {offer.id} ...')
             json: dict = {
@@ -93,11 +157,27 @@ class OfferManager:
                 'newListingPrice': offer.listing_price,
                 'variantId': offer.variant_id
             }
-            r: Response = await self.seller.s.post(URL_OFFERS, json=json, proxy=self.proxies.random)
-            if r.status_code == 201:
-                self.log.success(f'Offer {offer.id} refused!')
-                self.webhook_s.send_refuse_offer(offer)
-            else:
-                self.log.error(f'Error while refusing offer {offer.id}: {r.status_code}')
+            await self._post_offer(json, deadline)
+
+            self.log.success(f'Offer {offer.id} refused!')
+            self.webhook_s.send_refuse_offer(offer)
+            return self._record(offer, 'REFUSED', SUCCESS)
+        except HttpError as e:
+            self.log.error(f'Error while refusing offer {offer.id}: {e.status_code}')
+            return self._record(offer, 'REFUSE_FAILED', FAILURE, str(e.status_code))
         except Exception as e:
             self.log.error(f'Error while refusing offer {offer.id}: {e}')
+            return self._record(offer, 'REFUSE_FAILED', FAILURE, str(e))
+
+    async def _post_offer(self, json: dict, deadline: float | None) -> None:
+        async def post():
+            r: Response = await self.seller.http.post(URL_OFFERS, json=json)
+            expect(r.status_code, 201)
+
+        await ACTION_POLICY.run(post, URL_OFFERS, deadline, self.log)
+
+    def _record(self, offer: Offer, status: str, outcome: str, detail: str = '') -> str:
+        if self.store:
+            self.store.record_offer(offer.id, self.log.task_number, status)
+            self.store.record_action('offer', offer.id, self.log.task_number, outcome, f'{status} {detail}'.strip())
+        return status
@@ -1,32 +1,70 @@
-import sys
-from asyncio import sleep
+import os
+import time
+from asyncio import sleep, to_thread, create_task, Event, Lock, Semaphore, Task
+from base64 import urlsafe_b64decode
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Coroutine
 
 from noble_tls import Session
 from requests import Response
 
-from models.wtn import Product, Account
+from models.wtn import Product, Account, Listing
+from utils import decode
 from utils.captcha import ReCaptchaV3
 from utils.config import Config
+from utils.http import HttpClient
 from utils.log import Log
+from utils.paginator import Paginator
 from utils.proxy import Proxies
-
-CSRF_URL: str = 'https://sell.wethenew.com/api/auth/csrf'
-CRED_URL: str = 'https://sell.wethenew.com/api/auth/callback/credentials'
-SESSION_URL: str = 'https://sell.wethenew.com/api/auth/session'
-PROFILE_URL: str = 'https://api-sell.wethenew.com/sellers/me'
-LISTING_URL: str = 'https://api-sell.wethenew.com/listings'
-PAYMENT_URL: str = 'https://api-sell.wethenew.com/payment-infos'
-SHIPPING_URL: str = 'https://api-sell.wethenew.com/addresses?type=shipping'
-C3_ANCHOR: str = (
+from utils.retry import RequestError, LOGIN_POLICY, expect
+from utils.session_cache import SessionCache
+
+SELL_URL: str = os.getenv('WTN_SELL_URL', 'https://sell.wethenew.com')
+API_URL: str = os.getenv('WTN_API_URL', 'https://api-sell.wethenew.com')
+
+CSRF_URL: str = f'{SELL_URL}/api/auth/csrf'
+CRED_URL: str = f'{SELL_URL}/api/auth/callback/credentials'
+SESSION_URL: str = f'{SELL_URL}/api/auth/session'
+PROFILE_URL: str = f'{API_URL}/sellers/me'
+LISTING_URL: str = f'{API_URL}/listings'
+PAYMENT_URL: str = f'{API_URL}/payment-infos'
+SHIPPING_URL: str = f'{API_URL}/addresses?type=shipping'
+SESSION_CACHE_DIR: str = 'sessions'
+TOKEN_REFRESH_MARGIN: float = 300
+TOKEN_CHECK_INTERVAL: float = 60
+TOKEN_MAX_BACKOFF: float = 900
+C3_ANCHOR: str = os.getenv('WTN_CAPTCHA_ANCHOR', (
     'https://www.google.com/recaptcha/api2/anchor?ar=1&k=6LfbSlUpAAAAABNgkya850A9AtuIxEzJtv5V5cO5&co='
     'aHR0cHM6Ly9zZWxsLndldGhlbmV3LmNvbTo0NDM.&hl=en&v=Ya-Cd6PbRI5ktAHEhm9JuKEu&size=invisible&cb=gpdfxohtm66a'
-)
+))
+
+
+class SellerInitError(Exception):
+    pass
+
+
+class TokenBackoff(SellerInitError):
+    pass
+
+
+def token_expiry(access_token: str, expires: str | None = None) -> float | None:
+    # The exp claim of the JWT is the real deadline, the session expiry only bounds the NextAuth cookie
+    try:
+        payload: str = access_token.split('.')[1]
+        return float(decode.loads(urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(expires.replace('Z', '+00:00')).timestamp() if expires else None
+    except ValueError:
+        return None
 
 
 class Seller:
 
     def __init__(self, proxies: Proxies, config: Config, session: Session, ua: str, account: Account, n: int):
-        self.log: Log = Log('Seller', config.log_level, task_number=n)
+        self.log: Log = Log.get('Seller', config.log_level, task_number=n)
 
         self.s: Session = session
         self.s.headers['content-type'] = 'application/json'
@@ -34,7 +72,16 @@ class Seller:
         self.s.timeout_seconds = int(config.monitor_timeout)
 
         self.proxies: Proxies = proxies
+        self.http: HttpClient = HttpClient(self.s, proxies, n)
+        self.http.on_unauthorized = self._on_unauthorized
         self.delay: float = config.monitor_delay
+        self.delay_min: float = config.monitor_delay_min
+        self.delay_max: float = config.monitor_delay_max
+        self.timeout: float = config.monitor_timeout
+        self.consign_semaphore: Semaphore = Semaphore(config.consign_concurrency)
+        self.offer_semaphore: Semaphore = Semaphore(config.offer_concurrency)
+        self.variant_ttl: float = config.variant_cache_ttl
+        self.variant_cache: str = config.variant_cache
         self.webhook_s = config.webhook_success
         self.webhook_m = config.webhook_monitor
         self.log_level: int = config.log_level
@@ -45,48 +92,218 @@ class Seller:
 
         self.csrf_token: str | None = None
         self.access_token: str | None = None
+        self.token_expires_at: float | None = None
+        self.token_issued_at: float | None = None
+        self.auth_lock: Lock = Lock()
+        self.refresh_failures: int = 0
+        self.refresh_retry_at: float = 0
         self.address_uuid: str | None = None
         self.payment_uuid: str | None = None
         self.first_name: str | None = None
 
-        self.listing: list[Product] | None = None
+        self.listing: Listing | None = None
+        self.listing_updated_at: float = 0
+        self.listing_ttl: float = config.session_listing_ttl
+        self.listing_refresh: float = config.listing_refresh
+        self.consumed: set[str] = set[str]()
+
+        self.actions_in_flight: int = 0
+        self.idle: Event = Event()
+        self.idle.set()
+
+        self.session_cache: SessionCache = SessionCache(SESSION_CACHE_DIR, account.email, account.password)
+        self.background_tasks: set[Task] = set[Task]()
+
+    async def init(self, restore: bool = True) -> Session | None:
+        if restore and await self._restore_session():
+            self.log.info(f'Restored session of {self.first_name}, {len(self.listing)} products in listing!')
+            return self.s
 
-    async def init(self) -> Session | None:
         self.csrf_token = await self._get_csrf_token()
         self.access_token = await self._get_access_token()
         self.first_name = await self._login()
         self.listing = await self._get_listing()
         self.address_uuid, self.payment_uuid = await self._get_uuids()
+        self.listing_updated_at = time.time()
+        await self._save_session()
 
         self.log.info(f'Logged in as {self.first_name}, {len(self.listing)} products in listing, ready to sell!')
         return self.s
 
-    async def _retry_with_delay(self, func, max_attempts: int) -> any:
-        for attempt in range(max_attempts):
+    async def refresh(self, stale: str | None = None) -> None:
+        async with self.auth_lock:
+            if stale is not None and self.s.headers.get('authorization') != stale:
+                return
+            # Every caller shares the backoff of the last failed refresh instead of solving captchas on each 401
+            wait: float = self.refresh_retry_at - time.monotonic()
+            if wait > 0:
+                raise TokenBackoff(f'Last refresh failed, next attempt in {wait:.0f}s')
+            self.log.info('Refreshing access token...')
+            try:
+                self.csrf_token = await self._get_csrf_token()
+                self.access_token = await self._get_access_token()
+                self.first_name = await self._login()
+            except SellerInitError:
+                self.refresh_failures += 1
+                backoff: float = min(TOKEN_CHECK_INTERVAL * 2 ** (self.refresh_failures - 1), TOKEN_MAX_BACKOFF)
+                self.refresh_retry_at = time.monotonic() + backoff
+                raise
+            self.refresh_failures, self.refresh_retry_at = 0, 0
+            await self._save_session()
+
+    async def _on_unauthorized(self, authorization: str | None) -> bool:
+        if authorization is None:
+            return False
+        try:
+            await self.refresh(authorization)
+        except SellerInitError:
+            return False
+        return self.s.headers.get('authorization') != authorization
+
+    async def monitor_token(self) -> None:
+        while True:
+            if self.token_expires_at is None or self.token_issued_at is None:
+                await sleep(TOKEN_CHECK_INTERVAL)
+                continue
+            # A token living less than twice the margin is refreshed halfway through instead of right after login
+            lifetime: float = self.token_expires_at - self.token_issued_at
+            delay: float = self.token_issued_at + max(lifetime / 2, lifetime - TOKEN_REFRESH_MARGIN) - time.time()
+            if delay > 0:
+                await sleep(min(delay, TOKEN_CHECK_INTERVAL))
+                continue
+            try:
+                await self.refresh(self.s.headers.get('authorization'))
+                await sleep(TOKEN_CHECK_INTERVAL)
+            except SellerInitError as e:
+                wait: float = self.refresh_retry_at - time.monotonic()
+                self.log.error(f'Failed to refresh access token, retrying in {wait:.0f}s: {e}')
+                await sleep(max(wait, TOKEN_CHECK_INTERVAL))
+
+    async def _restore_session(self) -> bool:
+        cached: dict | None = await to_thread(self.session_cache.load)
+        if not cached:
+            return False
+
+        for name, value, domain, path in cached['cookies']:
+            self.s.cookies.set(name, value, domain=domain, path=path)
+        self.s.headers['authorization'] = f'Bearer {cached["access_token"]}'
+        try:
+            r: Response = await self.http.get(url=PROFILE_URL, reauth=False)
+        except Exception as e:
+            self.log.debug(f'Failed to check cached session: {e}')
+            r = None
+        if r is None or r.status_code != 200:
+            self.log.debug('Cached session is no longer valid, logging in...')
+            self.s.headers.pop('authorization', None)
+            if r is not None:
+                await to_thread(self.session_cache.clear)
+            return False
+
+        self.access_token = cached['access_token']
+        self.token_expires_at = cached.get('token_expires_at') or token_expiry(self.access_token)
+        self.token_issued_at = cached.get('token_issued_at') or time.time()
+        self.first_name = decode.body(r).get('firstname')
+        self.address_uuid = cached['address_uuid']
+        self.payment_uuid = cached['payment_uuid']
+        self.listing = Listing([Product(**product) for product in cached['listing']])
+        self.listing_updated_at = cached['listing_updated_at']
+
+        if time.time() - self.listing_updated_at > self.listing_ttl:
+            self.log.debug('Cached listing is stale, refreshing in background...')
+            self._run_in_background(self._reload_listing())
+        return True
+
+    async def _reload_listing(self) -> None:
+        try:
+            await self._refresh_listing()
+        except SellerInitError as e:
+            self.log.error(f'Failed to refresh listing: {e}')
+
+    async def monitor_listing(self) -> None:
+        if not self.listing_refresh:
+            return
+        while True:
+            await sleep(self.listing_refresh)
             try:
-                await sleep(self.delay)
-                return await func()
+                await self._refresh_listing()
             except Exception as e:
-                if 'Client.Timeout exceeded' in str(e):
-                    self.log.warning('TLSClientException (timeout), retrying...')
-                elif 'Proxy responded with non 200 code' in str(e):
-                    self.log.warning('Proxy responded with non 200 code, retrying...')
-                else:
-                    self.log.error(f'Error while executing {func.__name__}: {e}')
-
-                self.log.debug(f'Retrying ({attempt + 1}/{max_attempts})')
-        self.log.error('Maximum attempts reached, failed to execute the operation')
-        sys.exit(1)
+                self.log.error(f'Failed to refresh listing: {e}')
+
+    async def _refresh_listing(self) -> None:
+        before: Listing = self.listing
+        fetched: Listing = await self._get_listing(low_priority=True)
+        added, removed, changed = before.delta(fetched)
+
+        products: dict[str, Product] = {product.id: product for product in self.listing}
+        for product in removed:
+            products.pop(product.id, None)
+        for product in changed:
+            if product.id in products:
+                products[product.id] = product
+        for product in added:
+            if product.id not in self.consumed:
+                products[product.id] = product
+
+        self.listing = Listing(list(products.values()))
+        self.listing_updated_at = time.time()
+        self.consumed &= {product.id for product in fetched}
+        self.log.debug(
+            f'Listing refreshed: {len(added)} added, {len(removed)} removed, {len(changed)} price changes'
+        )
+        await self._save_session()
+
+    def consume(self, product: Product) -> None:
+        self.listing.remove(product)
+        self.consumed.add(product.id)
+
+    @asynccontextmanager
+    async def action(self) -> AsyncIterator[None]:
+        self.actions_in_flight += 1
+        self.idle.clear()
+        try:
+            yield
+        finally:
+            self.actions_in_flight -= 1
+            if not self.actions_in_flight:
+                self.idle.set()
+
+    async def _save_session(self) -> None:
+        data: dict = {
+            'access_token': self.access_token,
+            'token_expires_at': self.token_expires_at,
+            'token_issued_at': self.token_issued_at,
+            'cookies': [[c.name, c.value, c.domain, c.path] for c in self.s.cookies],
+            'address_uuid': self.address_uuid,
+            'payment_uuid': self.payment_uuid,
+            'first_name': self.first_name,
+            'listing': [product.to_dict() for product in self.listing],
+            'listing_updated_at': self.listing_updated_at,
+        }
+        await to_thread(self.session_cache.save, data)
+
+    def _run_in_background(self, coro: Coroutine) -> None:
+        task: Task = create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def _retry(self, func: Callable[[], Awaitable], url: str) -> any:
+        try:
+            return await LOGIN_POLICY.run(func, url, log=self.log)
+        except Exception as e:
+            self.log.error(f'Failed to execute {func.__name__}: {e}')
+            raise SellerInitError(f'Failed to execute {func.__name__}: {e}') from e
 
     async def _get_csrf_token(self) -> str | None:
         async def attempt_fetch():
-            r: Response = await self.s.get(url=CSRF_URL, proxy=self.proxies.random)
-            if r.status_code == 200 and 'csrfToken' in r.json():
+            r: Response = await self.http.get(url=CSRF_URL, reauth=False)
+            expect(r.status_code, 200, message=f'Failed to retrieve csrfToken, status code: {r.status_code}')
+            data: dict = decode.body(r)
+            if 'csrfToken' in data:
                 self.log.debug('Successfully retrieved csrfToken')
-                return r.json()['csrfToken']
-            raise Exception(f'Failed to retrieve csrfToken, status code: {r.status_code}')
+                return data['csrfToken']
+            raise RequestError('Failed to retrieve csrfToken')
 
-        return await self._retry_with_delay(attempt_fetch, 5)
+        return await self._retry(attempt_fetch, CSRF_URL)
 
     async def _get_access_token(self) -> str | None:
         async def attempt_fetch():
@@ -94,87 +311,77 @@ class Seller:
                 'redirect': 'false',
                 'email': self.email,
                 'password': self.password,
-                'recaptchaToken': ReCaptchaV3(C3_ANCHOR, 5).solve(),
+                'recaptchaToken': await to_thread(ReCaptchaV3(C3_ANCHOR, 5).solve),
                 'pushToken': 'undefined',
                 'os': 'undefined',
                 'osVersion': 'undefined',
                 'csrfToken': self.csrf_token,
-                'callbackUrl': 'https://sell.wethenew.com/login',
+                'callbackUrl': f'{SELL_URL}/login',
                 'json': 'true'
             }
 
-            r: Response = await self.s.post(url=CRED_URL, json=data, proxy=self.proxies.random)
-            if r.status_code != 200:
-                raise Exception(f'Failed to post credentials, status code: {r.status_code}')
+            r: Response = await self.http.post(url=CRED_URL, json=data, reauth=False)
+            expect(r.status_code, 200, message=f'Failed to post credentials, status code: {r.status_code}')
 
-            r: Response = await self.s.get(url=SESSION_URL, proxy=self.proxies.random)
-            if r.status_code == 200 and r.json().get('user').get('accessToken'):
+            r: Response = await self.http.get(url=SESSION_URL, reauth=False)
+            expect(r.status_code, 200, message=f'Failed to retrieve session, status code: {r.status_code}')
+            session: dict = decode.body(r)
+            access_token: str | None = (session.get('user') or {}).get('accessToken')
+            if access_token:
+                self.token_expires_at = token_expiry(access_token, session.get('expires'))
+                self.token_issued_at = time.time()
                 self.log.debug('Successfully retrieved accessToken token')
-                return r.json().get('user').get('accessToken')
-            raise Exception('Failed to retrieve accessToken token')
+                return access_token
+            raise RequestError('Failed to retrieve accessToken token')
 
-        return await self._retry_with_delay(attempt_fetch, 5)
+        return await self._retry(attempt_fetch, CRED_URL)
 
     async def _login(self) -> str:
         async def attempt_login():
             self.s.headers['authorization'] = f'Bearer {self.access_token}'
-            r: Response = await self.s.get(url=PROFILE_URL, proxy=self.proxies.random)
-            if r.status_code == 200:
-                firstname: str = r.json().get('firstname')
-                self.log.debug(f'Logged in as {firstname}')
-                return firstname
-            raise Exception(f'Failed to login, status code: {r.status_code}')
+            r: Response = await self.http.get(url=PROFILE_URL, reauth=False)
+            expect(r.status_code, 200, message=f'Failed to login, status code: {r.status_code}')
+            firstname: str = decode.body(r).get('firstname')
+            self.log.debug(f'Logged in as {firstname}')
+            return firstname
+
+        return await self._retry(attempt_login, PROFILE_URL)
+
+    def _fetch_listing(self, params: dict) -> Awaitable[Response]:
+        return self.http.get(url=LISTING_URL, params=params)
 
-        return await self._retry_with_delay(attempt_login, 5)
+    async def _fetch_listing_when_idle(self, params: dict) -> Response:
+        await self.idle.wait()
+        return await self._fetch_listing(params)
 
-    async def _get_listing(self) -> list[Product] | None:
+    async def _get_listing(self, low_priority: bool = False) -> Listing | None:
         async def attempt_fetch():
             listing: list[Product] = []
-            skip: int = 0
-            while True:
-                params: dict = {'take': 100, 'skip': skip}
-                r: Response = await self.s.get(url=LISTING_URL, proxy=self.proxies.random, params=params)
-                if r.status_code != 200:
-                    raise Exception(f'Failed to fetch listing, status code: {r.status_code}')
-
-                results: list = r.json().get('results', [])
-                if not results:
-                    break
-
-                listing.extend(
-                    [
-                        Product(
-                            id=result['name'],
-                            name=result['product']['name'],
-                            image=result['product']['image'],
-                            size=result['product']['europeanSize'],
-                            price=result['price'],
-                        ) for result in results
-                    ]
-                )
-                skip += 100
+            fetch: Callable[[dict], Awaitable[Response]] = (
+                self._fetch_listing_when_idle if low_priority else self._fetch_listing
+            )
+            async for products in Paginator(fetch, parse=decode.products).pages():
+                listing.extend(products)
 
             self.log.debug(f'Successfully fetched {len(listing)} products from listing')
-            return listing
+            return Listing(listing)
 
-        return await self._retry_with_delay(attempt_fetch, 5)
+        return await self._retry(attempt_fetch, LISTING_URL)
 
     async def _get_uuids(self) -> tuple[str, str] | None:
         async def attempt_fetch():
-            r: Response = await self.s.get(url=PAYMENT_URL, proxy=self.proxies.random)
-            if r.status_code != 200:
-                raise Exception(f'Failed to fetch uuids, status code: {r.status_code}')
-            payment_uuid: str = r.json()[0].get('uuid')
+            r: Response = await self.http.get(url=PAYMENT_URL)
+            expect(r.status_code, 200, message=f'Failed to fetch uuids, status code: {r.status_code}')
+            payment_uuid: str = decode.body(r)[0].get('uuid')
 
-            r: Response = await self.s.get(url=SHIPPING_URL, proxy=self.proxies.random)
-            if r.status_code != 200:
-                raise Exception(f'Failed to fetch uuids, status code: {r.status_code}')
-            address_uuid: str = r.json().get('uuid')
+            r: Response = await self.http.get(url=SHIPPING_URL)
+            expect(r.status_code, 200, message=f'Failed to fetch uuids, status code: {r.status_code}')
+            address_uuid: str = decode.body(r).get('uuid')
 
             if not address_uuid or not payment_uuid:
-                raise Exception('Failed to fetch uuids')
+                raise RequestError('Failed to fetch uuids')
 
             self.log.debug('Successfully fetched uuids')
             return address_uuid, payment_uuid
 
-        return await self._retry_with_delay(attempt_fetch, 5)
+        return await self._retry(attempt_fetch, PAYMENT_URL)
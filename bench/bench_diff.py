@@ -0,0 +1,46 @@
+# Micro-benchmark of the consignment-slot diff: python -m bench.bench_diff
+import random
+import time
+
+from utils.diff import ConsignDiff
+
+SIZES: list[str] = [str(size) for size in range(36, 48)] + [f'{size}.5' for size in range(36, 48)]
+POLLS: int = 200
+CHANGE_RATE: float = 0.01
+
+
+def make_slot(c_id: int) -> dict:
+    return {
+        'id': c_id,
+        'brand': 'Nike',
+        'name': f'Dunk Low {c_id}',
+        'image': f'https://image.wethenew.com/{c_id}.png',
+        'sizes': random.sample(SIZES, random.randint(1, 8)),
+    }
+
+
+def mutate(results: list[dict]) -> list[dict]:
+    polled: list[dict] = [dict(result) for result in results]
+    for result in random.sample(polled, max(1, int(len(polled) * CHANGE_RATE))):
+        result['sizes'] = random.sample(SIZES, random.randint(1, 8))
+    return polled
+
+
+def bench(n: int) -> float:
+    random.seed(n)
+    diff: ConsignDiff = ConsignDiff()
+    results: list[dict] = [make_slot(c_id) for c_id in range(n)]
+    diff.reset(results)
+
+    polls: list[list[dict]] = [mutate(results) for _ in range(POLLS)]
+    start: float = time.perf_counter()
+    for polled in polls:
+        diff.diff(polled)
+    return (time.perf_counter() - start) / POLLS
+
+
+if __name__ == '__main__':
+    print(f'{"slots":>8} {"per poll":>12} {"per slot":>12}')
+    for n in [100, 500, 1_000, 2_500, 5_000, 10_000]:
+        elapsed: float = bench(n)
+        print(f'{n:>8} {elapsed * 1e3:>10.3f}ms {elapsed / n * 1e9:>10.0f}ns')
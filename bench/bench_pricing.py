@@ -0,0 +1,66 @@
+# Micro-benchmark of the pricing rule engine: python -m bench.bench_pricing
+import random
+import time
+
+from models.wtn import Offer
+from utils.pricing import Rule, RuleSet
+
+SIZES: list[str] = [str(size) for size in range(36, 48)] + [f'{size}.5' for size in range(36, 48)]
+BRANDS: list[str] = ['Nike', 'Jordan', 'Adidas', 'New Balance', 'Asics', 'Yeezy', 'Salomon', 'Converse']
+BATCH: int = 100
+ROUNDS: int = 200
+
+
+def make_rule(i: int) -> Rule:
+    kind: float = random.random()
+    if kind < 0.6:
+        return Rule(sku=f'SKU-{i}', sizes=frozenset(random.sample(SIZES, 3)), delta=random.randint(0, 30))
+    if kind < 0.8:
+        return Rule(sku=f'SKU-{i}', size_min=38, size_max=42, percent=random.randint(0, 15), floor=80)
+    if kind < 0.95:
+        return Rule(sku=f'SKU-{i}', delta=random.randint(0, 30), ceiling=random.randint(300, 600))
+    return Rule(brand=random.choice(BRANDS).lower(), size_min=random.randint(36, 40), percent=5)
+
+
+def make_offer(i: int, skus: int) -> Offer:
+    listing_price: int = random.randint(100, 400)
+    return Offer(
+        id=f'offer-{i}',
+        name=f'Sneaker {i}',
+        variant_id=i,
+        sku=f'SKU-{random.randrange(skus * 2)}',
+        brand=random.choice(BRANDS),
+        image='',
+        size=random.choice(SIZES),
+        listing_price=listing_price,
+        price=listing_price - random.randint(0, 60),
+        createTime='',
+    )
+
+
+def bench(n: int) -> tuple[float, float, float]:
+    random.seed(n)
+    rules: list[Rule] = [make_rule(i) for i in range(n)]
+    batches: list[list[Offer]] = [[make_offer(i * BATCH + j, n) for j in range(BATCH)] for i in range(ROUNDS)]
+
+    start: float = time.perf_counter()
+    rule_set: RuleSet = RuleSet(rules)
+    compiled: float = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for batch in batches:
+        rule_set.decide(batch, 10)
+    cold: float = (time.perf_counter() - start) / (ROUNDS * BATCH)
+
+    start = time.perf_counter()
+    for batch in batches:
+        rule_set.decide(batch, 10)
+    warm: float = (time.perf_counter() - start) / (ROUNDS * BATCH)
+    return compiled, cold, warm
+
+
+if __name__ == '__main__':
+    print(f'{"rules":>8} {"compile":>12} {"cold/offer":>12} {"warm/offer":>12}')
+    for n in [100, 1_000, 5_000, 10_000, 50_000]:
+        compiled, cold, warm = bench(n)
+        print(f'{n:>8} {compiled * 1e3:>10.2f}ms {cold * 1e6:>10.2f}us {warm * 1e6:>10.2f}us')
@@ -0,0 +1,259 @@
+# Local stand-in for the WeTheNew seller API: python -m bench.mock_server --port 8800
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit, parse_qs
+
+SIZES: list[str] = [str(size) for size in range(38, 47)] + [f'{size}.5' for size in range(38, 46)]
+ID_SEGMENT: re.Pattern = re.compile(r'/(\d+|[0-9a-f]{32})(?=/|$)')
+REASONS: dict[int, str] = {200: 'OK', 201: 'Created', 401: 'Unauthorized', 404: 'Not Found', 503: 'Service Unavailable'}
+
+
+@dataclass
+class Faults:
+    latency: tuple[float, float] = (0, 0)
+    error_rate: float = 0
+    unauthorized_rate: float = 0
+
+
+@dataclass
+class SellerState:
+    email: str
+    token: str
+    listing: dict[str, dict] = field(default_factory=dict)
+    offers: dict[str, dict] = field(default_factory=dict)
+
+
+class MockServer:
+    def __init__(self, products: int = 200, listing_size: int = 50, faults: Faults = Faults(), seed: int = 0):
+        self.random: random.Random = random.Random(seed)
+        self.faults: Faults = faults
+        self.products: list[str] = [f'Mock Sneaker {i}' for i in range(products)]
+        self.listing_size: int = listing_size
+
+        self.sellers: dict[str, SellerState] = {}
+        self.sessions: dict[str, SellerState] = {}
+        self.slots: dict[int, dict] = {}
+        self.created_at: dict[tuple, float] = {}
+
+        self.requests: dict[str, int] = {}
+        self.latencies: dict[str, list[float]] = {'offer': [], 'consign': []}
+        self.started_at: float = time.time()
+
+        for c_id, name in enumerate(self.products, start=1):
+            self.slots[c_id] = {
+                'id': c_id,
+                'brand': 'Mock',
+                'name': name,
+                'image': f'https://mock.local/{c_id}.png',
+                'sizes': self.random.sample(SIZES, 3),
+            }
+
+    # Scripted events
+
+    def add_offer(self) -> None:
+        sellers: list[SellerState] = [seller for seller in self.sellers.values() if seller.listing]
+        if not sellers:
+            return
+        seller: SellerState = self.random.choice(sellers)
+        listing: dict = self.random.choice(list(seller.listing.values()))
+        o_id: str = uuid.uuid4().hex
+        seller.offers[o_id] = {
+            'id': o_id,
+            'name': listing['product']['name'],
+            'variantId': self.random.randint(1, 10 ** 6),
+            'sku': f'SKU-{listing["product"]["name"].rsplit(" ", 1)[-1]}',
+            'brand': 'Mock',
+            'image': listing['product']['image'],
+            'europeanSize': listing['product']['europeanSize'],
+            'listingPrice': listing['price'],
+            'price': listing['price'] - self.random.randint(0, 30),
+            'createTime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        }
+        self.created_at[('offer', o_id)] = time.perf_counter()
+
+    def add_slot_size(self) -> None:
+        slot: dict = self.slots[self.random.randint(1, len(self.slots))]
+        missing: list[str] = [size for size in SIZES if size not in slot['sizes']]
+        if not missing:
+            slot['sizes'] = slot['sizes'][:1]
+            return
+        size: str = self.random.choice(missing)
+        slot['sizes'] = slot['sizes'] + [size]
+        self.created_at[('consign', slot['name'], size)] = time.perf_counter()
+
+    async def generate(self, rate: float, consign_ratio: float = 0.5) -> None:
+        while True:
+            await asyncio.sleep(self.random.expovariate(rate))
+            self.add_slot_size() if self.random.random() < consign_ratio else self.add_offer()
+
+    # HTTP plumbing
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                head: bytes = await reader.readuntil(b'\r\n\r\n')
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                method, target, _ = request_line.split(' ', 2)
+                headers: dict[str, str] = {}
+                for line in header_lines:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                body: bytes = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, payload, extra = await self.route(method, target, headers, body)
+                data: bytes = json.dumps(payload).encode()
+                response: list[str] = [
+                    f'HTTP/1.1 {status} {REASONS.get(status, "OK")}',
+                    'Content-Type: application/json',
+                    f'Content-Length: {len(data)}',
+                    'Cf-Cache-Status: MISS',
+                    *extra,
+                ]
+                writer.write(('\r\n'.join(response) + '\r\n\r\n').encode() + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method: str, target: str, headers: dict[str, str], body: bytes) -> tuple[int, object, list]:
+        url = urlsplit(target)
+        path: str = url.path
+        params: dict[str, str] = {key: values[0] for key, values in parse_qs(url.query).items()}
+        key: str = f'{method} {ID_SEGMENT.sub("/{id}", path)}'
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+        if path == '/__stats':
+            return 200, self.stats(), []
+        if path.startswith('/webhook'):
+            return 200, {}, []
+
+        low, high = self.faults.latency
+        if high:
+            await asyncio.sleep(self.random.uniform(low, high))
+        if self.random.random() < self.faults.error_rate:
+            return 503, {'message': 'Injected error'}, []
+
+        if path == '/api/auth/csrf':
+            return 200, {'csrfToken': uuid.uuid4().hex}, []
+        if path == '/api/auth/callback/credentials':
+            email: str = json.loads(body or b'{}').get('email', 'anonymous')
+            seller: SellerState = self.sellers.get(email) or self._new_seller(email)
+            seller.token = uuid.uuid4().hex
+            self.sessions[seller.token] = seller
+            return 200, {'url': '/login'}, [f'Set-Cookie: session={seller.token}; Path=/']
+        if path == '/api/auth/session':
+            cookie: str = headers.get('cookie', '').partition('session=')[2].split(';')[0]
+            seller: SellerState | None = self.sessions.get(cookie)
+            if seller is None:
+                return 200, {}, []
+            return 200, {'user': {'accessToken': seller.token}, 'expires': '2099-01-01T00:00:00.000Z'}, []
+
+        seller: SellerState | None = self.sessions.get(headers.get('authorization', '').removeprefix('Bearer '))
+        if seller is None or self.random.random() < self.faults.unauthorized_rate:
+            return 401, {'message': 'Unauthorized'}, []
+
+        if path == '/sellers/me':
+            return 200, {'firstname': seller.email.split('@')[0]}, []
+        if path == '/payment-infos':
+            return 200, [{'uuid': f'payment-{seller.email}'}], []
+        if path == '/addresses':
+            return 200, {'uuid': f'address-{seller.email}'}, []
+        if path == '/listings':
+            return 200, self._page(list(seller.listing.values()), params), []
+        if path.startswith('/listings/') and method == 'DELETE':
+            seller.listing.pop(path.rsplit('/', 1)[-1], None)
+            return 200, {}, []
+        if path == '/offers' and method == 'GET':
+            return 200, self._page(list(seller.offers.values()), params), []
+        if path == '/offers' and method == 'POST':
+            o_id: str = json.loads(body)['name']
+            if seller.offers.pop(o_id, None) is None:
+                return 404, {'message': 'Offer not found'}, []
+            self._record('offer', ('offer', o_id))
+            return 201, {}, []
+        if path == '/consignment-slots':
+            return 200, self._page(list(self.slots.values()), params), []
+        if path.startswith('/products/') and path.endswith('/consignments'):
+            c_id: int = int(path.split('/')[2])
+            return 200, {'variants': [{'id': c_id * 100 + i, 'europeanSize': s} for i, s in enumerate(SIZES)]}, []
+        if path == '/consignments':
+            variant_id: int = json.loads(body)['consignments'][0]['variantId']
+            slot: dict | None = self.slots.get(variant_id // 100)
+            if slot is not None:
+                self._record('consign', ('consign', slot['name'], SIZES[variant_id % 100]))
+            return 201, {}, []
+        return 404, {'message': f'No route for {method} {path}'}, []
+
+    def _new_seller(self, email: str) -> SellerState:
+        seller: SellerState = SellerState(email=email, token='')
+        for _ in range(self.listing_size):
+            l_id: str = uuid.uuid4().hex
+            seller.listing[l_id] = {
+                'name': l_id,
+                'price': self.random.randint(100, 400),
+                'product': {
+                    'name': self.random.choice(self.products),
+                    'image': 'https://mock.local/listing.png',
+                    'europeanSize': self.random.choice(SIZES),
+                },
+            }
+        self.sellers[email] = seller
+        return seller
+
+    @staticmethod
+    def _page(items: list, params: dict[str, str]) -> dict:
+        take: int = int(params.get('take', 100))
+        skip: int = int(params.get('skip', 0))
+        return {'results': items[skip:skip + take], 'pagination': {'totalCount': len(items)}}
+
+    def _record(self, kind: str, key: tuple) -> None:
+        created_at: float | None = self.created_at.pop(key, None)
+        if created_at is not None:
+            self.latencies[kind].append(time.perf_counter() - created_at)
+
+    def stats(self) -> dict:
+        return {
+            'uptime': time.time() - self.started_at,
+            'requests': self.requests,
+            'latencies': self.latencies,
+        }
+
+    async def serve(self, host: str, port: int, rate: float = 0) -> None:
+        server: asyncio.Server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            if rate:
+                asyncio.create_task(self.generate(rate))
+            await server.serve_forever()
+
+
+def parse_args(args: list[str] | None = None) -> argparse.Namespace:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description='Mock WeTheNew seller API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--rate', type=float, default=2, help='scripted events per second')
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--listing-size', type=int, default=50)
+    parser.add_argument('--latency', type=float, nargs=2, default=(0, 0), metavar=('MIN', 'MAX'))
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--unauthorized-rate', type=float, default=0)
+    return parser.parse_args(args)
+
+
+def run(args: argparse.Namespace) -> None:
+    faults: Faults = Faults(tuple(args.latency), args.error_rate, args.unauthorized_rate)
+    server: MockServer = MockServer(args.products, args.listing_size, faults)
+    asyncio.run(server.serve(args.host, args.port, args.rate))
+
+
+if __name__ == '__main__':
+    run(parse_args())
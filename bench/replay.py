@@ -0,0 +1,145 @@
+# Offline replay of a CAPTURE_FILE through main.main: python -m bench.replay capture.jsonl.gz [--paced]
+# Round trip of the monitor polls through Capture and Replay: python -m bench.replay --check
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Callable
+
+from bench.run import percentiles, sample_loop_lag
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_workdir(args: argparse.Namespace) -> str:
+    workdir: str = tempfile.mkdtemp(prefix='wtn-replay-')
+    with open(os.path.join(workdir, 'accounts.csv'), 'w') as f:
+        f.write('mail,password,price_delta\n')
+        for i in range(args.accounts):
+            f.write(f'replay{i}@replay.local,password,{args.price_delta}\n')
+    with open(os.path.join(workdir, 'proxies.txt'), 'w') as f:
+        f.write('127.0.0.1:9\n')
+
+    os.environ.update({
+        'MONITOR_DELAY': '0',
+        'MONITOR_TIMEOUT': '5',
+        'WEBHOOK_SUCCESS': 'http://127.0.0.1:9/webhook/success',
+        'LOG_LEVEL': str(args.log_level),
+        'INIT_CONCURRENCY': str(args.accounts),
+        'LISTING_REFRESH': '0',
+        'WTN_CAPTCHA_ANCHOR': '',
+    })
+    return workdir
+
+
+async def replay(capture: str, paced: bool, duration: float, lag: list[float]) -> dict[str, int]:
+    import main
+    from api.consign import URL_CONSIGN_ALL
+    from api.offer import URL_OFFERS
+    from utils.capture import Replay
+    from utils.metrics import endpoint
+
+    Replay.active = Replay(capture, paced, until=(endpoint(URL_OFFERS), endpoint(URL_CONSIGN_ALL)))
+    sampler: asyncio.Task = asyncio.create_task(sample_loop_lag(lag))
+    toolbox: asyncio.Task = asyncio.create_task(main.main())
+    try:
+        await asyncio.wait_for(Replay.active.done.wait(), duration)
+        # Let the actions triggered by the last responses finish before stopping
+        await asyncio.sleep(1)
+    except TimeoutError:
+        print(f'Replay did not finish within {duration:.0f}s')
+    finally:
+        toolbox.cancel()
+        sampler.cancel()
+        await asyncio.gather(toolbox, return_exceptions=True)
+    return Replay.active.served
+
+
+async def check() -> None:
+    from requests import Response
+
+    from api.consign import ConsignManager, URL_CONSIGN_ALL
+    from api.offer import OfferManager, URL_OFFERS
+    from utils.capture import Capture, Replay
+    from utils.metrics import endpoint
+
+    polls: list[tuple[Callable, str, dict]] = [
+        (OfferManager._fetch_offers, URL_OFFERS, {'results': [{'id': 'offer'}]}),
+        (ConsignManager._fetch_consigns, URL_CONSIGN_ALL, {'results': [{'id': 'consign'}]}),
+    ]
+    bodies: dict[str, dict] = {url: body for _, url, body in polls}
+
+    async def record(url: str, params: dict) -> Response:
+        r: Response = Replay.response(200, {'Cf-Cache-Status': 'MISS'}, bodies[url])
+        Capture.active.record('get', url, {'params': dict(params)}, time.perf_counter(), 0, r)
+        return r
+
+    # The monitors' own fetch functions send the requests, a fresh nocache on each side like a real poll
+    path: str = os.path.join(tempfile.mkdtemp(prefix='wtn-replay-'), 'check.jsonl.gz')
+    Capture.open(path)
+    try:
+        for fetch, url, _ in polls:
+            await fetch(SimpleNamespace(http=SimpleNamespace(get=record)), {'page': 1})
+    finally:
+        Capture.close()
+
+    replay: Replay = Replay(path, until=(endpoint(URL_OFFERS), endpoint(URL_CONSIGN_ALL)))
+    for fetch, url, body in polls:
+        r: Response = await fetch(SimpleNamespace(http=replay), {'page': 1})
+        assert r.status_code == 200 and r.json() == body, f'{endpoint(url)} was not served its captured poll'
+    assert replay.done.is_set(), 'Replay did not finish after every captured poll was served'
+
+
+def parse_args() -> argparse.Namespace:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description='Replay captured WeTheNew traffic')
+    parser.add_argument('capture', nargs='?', help='CAPTURE_FILE written by the toolbox')
+    parser.add_argument('--check', action='store_true', help='check that captured polls are replayed and exit')
+    parser.add_argument('--paced', action='store_true', help='keep the original timing instead of replaying at once')
+    parser.add_argument('--accounts', type=int, default=1)
+    parser.add_argument('--price-delta', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=600, help='give up after this many seconds')
+    parser.add_argument('--log-level', type=int, default=4)
+    args: argparse.Namespace = parser.parse_args()
+    if not args.check and not args.capture:
+        parser.error('the capture argument is required')
+    return args
+
+
+def run() -> None:
+    args: argparse.Namespace = parse_args()
+    if args.check:
+        sys.path.insert(0, ROOT)
+        asyncio.run(check())
+        print('Replay round trip OK')
+        return
+    capture: str = os.path.abspath(args.capture)
+    os.chdir(setup_workdir(args))
+    sys.path.insert(0, ROOT)
+
+    from utils.metrics import DETECTION_TO_ACTION
+
+    lag: list[float] = []
+    start: float = time.perf_counter()
+    served: dict[str, int] = asyncio.run(replay(capture, args.paced, args.duration, lag))
+    elapsed: float = time.perf_counter() - start
+
+    requests: int = sum(served.values())
+    print()
+    print(f'mode:                {"paced" if args.paced else "fast"}')
+    print(f'duration:            {elapsed:.1f}s')
+    print(f'requests:            {requests} ({requests / elapsed:.1f} req/s)')
+    for key, count in sorted(served.items(), key=lambda item: -item[1]):
+        print(f'  {key:<40} {count}')
+    for values, series in DETECTION_TO_ACTION.series.items():
+        p50, p99 = DETECTION_TO_ACTION.quantile(series, 0.5), DETECTION_TO_ACTION.quantile(series, 0.99)
+        print(f'{values[0] + " to action:":<21}{series[-1]:.0f} actions, p50<={p50}s p99<={p99}s')
+    print(f'event-loop lag:      {percentiles(lag)}')
+    print(f'peak memory:         {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f}MB')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,141 @@
+# End-to-end benchmark of main.main against the mock API: python -m bench.run --accounts 10 --duration 60
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import tempfile
+import time
+import urllib.request
+
+from bench import mock_server
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentiles(values: list[float]) -> str:
+    if not values:
+        return 'no samples'
+    values = sorted(values)
+
+    def pick(q: float) -> float:
+        return values[min(len(values) - 1, int(q * len(values)))] * 1e3
+
+    return f'p50={pick(0.5):.1f}ms p95={pick(0.95):.1f}ms p99={pick(0.99):.1f}ms max={values[-1] * 1e3:.1f}ms'
+
+
+def wait_for_port(port: int, timeout: float = 10) -> None:
+    deadline: float = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f'Mock server did not start on port {port}')
+
+
+def setup_workdir(args: argparse.Namespace) -> str:
+    workdir: str = tempfile.mkdtemp(prefix='wtn-bench-')
+    with open(os.path.join(workdir, 'accounts.csv'), 'w') as f:
+        f.write('mail,password,price_delta\n')
+        for i in range(args.accounts):
+            f.write(f'bench{i}@mock.local,password,{args.price_delta}\n')
+    with open(os.path.join(workdir, 'proxies.txt'), 'w') as f:
+        f.write(f'127.0.0.1:{args.port}\n')
+
+    base_url: str = f'http://127.0.0.1:{args.port}'
+    os.environ.update({
+        'MONITOR_DELAY': str(args.delay),
+        'MONITOR_TIMEOUT': '5',
+        'WEBHOOK_SUCCESS': f'{base_url}/webhook/success',
+        'WEBHOOK_MONITOR': f'{base_url}/webhook/monitor',
+        'LOG_LEVEL': str(args.log_level),
+        'INIT_CONCURRENCY': str(args.accounts),
+        'WTN_API_URL': base_url,
+        'WTN_SELL_URL': base_url,
+        'WTN_CAPTCHA_ANCHOR': '',
+    })
+    return workdir
+
+
+async def sample_loop_lag(samples: list[float], interval: float = 0.05) -> None:
+    while True:
+        start: float = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def bench(duration: float, lag: list[float]) -> None:
+    import main
+
+    sampler: asyncio.Task = asyncio.create_task(sample_loop_lag(lag))
+    try:
+        await asyncio.wait_for(main.main(), duration)
+    except TimeoutError:
+        pass
+    finally:
+        sampler.cancel()
+
+
+def parse_args() -> argparse.Namespace:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description='End-to-end WeTheToolbox benchmark')
+    parser.add_argument('--accounts', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--rate', type=float, default=2, help='scripted events per second')
+    parser.add_argument('--delay', type=float, default=1, help='MONITOR_DELAY of the toolbox')
+    parser.add_argument('--price-delta', type=int, default=10)
+    parser.add_argument('--latency', type=float, nargs=2, default=(0.02, 0.08), metavar=('MIN', 'MAX'))
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--unauthorized-rate', type=float, default=0)
+    parser.add_argument('--log-level', type=int, default=4)
+    return parser.parse_args()
+
+
+def run() -> None:
+    args: argparse.Namespace = parse_args()
+    server_args: argparse.Namespace = mock_server.parse_args([
+        '--port', str(args.port),
+        '--rate', str(args.rate),
+        '--latency', *map(str, args.latency),
+        '--error-rate', str(args.error_rate),
+        '--unauthorized-rate', str(args.unauthorized_rate),
+    ])
+    server: multiprocessing.Process = multiprocessing.get_context('spawn').Process(
+        target=mock_server.run, args=(server_args,), daemon=True
+    )
+    server.start()
+    try:
+        wait_for_port(args.port)
+        os.chdir(setup_workdir(args))
+        sys.path.insert(0, ROOT)
+
+        lag: list[float] = []
+        start: float = time.perf_counter()
+        asyncio.run(bench(args.duration, lag))
+        elapsed: float = time.perf_counter() - start
+
+        with urllib.request.urlopen(f'http://127.0.0.1:{args.port}/__stats') as r:
+            stats: dict = json.loads(r.read())
+    finally:
+        server.terminate()
+
+    requests: int = sum(count for key, count in stats['requests'].items() if '/__stats' not in key)
+    print()
+    print(f'accounts:            {args.accounts}')
+    print(f'duration:            {elapsed:.1f}s')
+    print(f'requests:            {requests} ({requests / elapsed:.1f} req/s)')
+    for key, count in sorted(stats['requests'].items(), key=lambda item: -item[1]):
+        print(f'  {key:<40} {count}')
+    print(f'offer to action:     {percentiles(stats["latencies"]["offer"])}')
+    print(f'consign to action:   {percentiles(stats["latencies"]["consign"])}')
+    print(f'event-loop lag:      {percentiles(lag)}')
+    print(f'peak memory:         {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f}MB')
+
+
+if __name__ == '__main__':
+    run()
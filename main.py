@@ -1,4 +1,7 @@
 import asyncio
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
 
 import noble_tls
 from colorama import init
@@ -7,42 +10,216 @@ from noble_tls import Session, Client
 
 from api.consign import ConsignManager
 from api.offer import OfferManager
-from api.seller import Seller
+from api.seller import Seller, SellerInitError
+from models.wtn import Account
+from utils.capture import Capture
 from utils.config import Config
 from utils.log import Log, LogLevel
+from utils.metrics import metrics
+from utils.pricing import PricingRules
 from utils.proxy import Proxies
+from utils.reload import FileWatcher, diff_accounts
+from utils.scheduler import PollScheduler
+from utils.store import StateStore
+from utils.supervisor import Supervisor, owner
+from utils.watchdog import Profiler, Watchdog
+from utils.webhook import WebHook
 
 init()
 logger = Log('Home', LogLevel.DEBUG)
 
+# Each seller's polls, listing refresh and token refresh on top of its offer and consign semaphores
+SELLER_BASE_THREADS: int = 8
+MAX_EXECUTOR_THREADS: int = 1024
+
 
 async def main():
     try:
         await noble_tls.update_if_necessary()
     except Exception as e:
         logger.warning(f'Failed to update noble_tls: {e}')
-    proxies: Proxies = Proxies()
     config: Config = Config()
-    sellers: list[Seller] = []
+    if config.workers > 1 and len(config.accounts) > 1:
+        await Supervisor(config, config.workers, worker).run()
+    else:
+        await run(config, list(enumerate(config.accounts, start=1)))
 
-    for task, account in enumerate(config.accounts, start=1):
-        s: Session = Session(client=Client.CHROME_120, random_tls_extension_order=True)
-        ua: str = UserAgent().random
 
-        seller: Seller = Seller(proxies, config, s, ua, account, task)
-        await seller.init()
-        sellers.append(seller)
+def worker(index: int, config: Config, accounts: list[tuple[int, Account]], events: Connection, poller: bool):
+    # Ctrl+C reaches the whole process group, a worker only stops on the supervisor's SIGTERM so its cleanup runs once
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    async def serve():
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            pass
+        await run(config, accounts, events, shard=(index, config.workers), poller=poller)
+
+    try:
+        asyncio.run(serve())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+async def run(
+        config: Config,
+        accounts: list[tuple[int, Account]],
+        events: Connection | None = None,
+        shard: tuple[int, int] = (0, 1),
+        poller: bool = True
+):
+    proxies: Proxies = Proxies()
+    if config.log_file:
+        Log.configure_file(config.log_file)
+    if config.capture_file:
+        Capture.open(config.capture_file)
+    await proxies.check()
+    store: StateStore = StateStore(config.state_db)
+    pricing: PricingRules = PricingRules(config.pricing_rules)
+    sellers: list[Seller] = []
+    owned: dict[str, int] = {account.email: task for task, account in accounts}
+    last_task: int = max(owned.values(), default=0)
+    running: dict[str, asyncio.Task] = {}
+    schedulers: dict[str, PollScheduler] = {}
+
+    # noble_tls sends every request from the default executor and captchas are solved in it, it must let through all the
+    # requests the semaphores allow or a page of offers queues behind min(32, cpu + 4) threads
+    per_seller: int = config.offer_concurrency + config.consign_concurrency + SELLER_BASE_THREADS
+    threads: int = min(MAX_EXECUTOR_THREADS, config.init_concurrency + max(1, len(accounts)) * per_seller)
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=threads))
+    semaphore: asyncio.Semaphore = asyncio.Semaphore(config.init_concurrency)
+    consign_ready: asyncio.Event = asyncio.Event()
+    pending: int = len(accounts)
 
-    async def start_offer(x: Seller):
-        offers: OfferManager = OfferManager(x)
+    async def start_offer(x: Seller, phase: float):
+        offers: OfferManager = OfferManager(x, phase, store, pricing)
+        schedulers[f'offer:{x.email}'] = offers.scheduler
         await offers.monitor_offers()
 
     async def start_consign(x: list[Seller]):
-        consigns: ConsignManager = ConsignManager(x)
-        await consigns.monitor_consigns()
+        await consign_ready.wait()
+        if not x:
+            logger.error('No account could be logged in, nothing to monitor')
+            if poller or events is None:
+                return
+            # The poller's events are read and dropped until a reload logs an account in, a full pipe would block it
+            while not x:
+                try:
+                    await asyncio.to_thread(events.recv_bytes)
+                except (EOFError, OSError):
+                    return
+        consigns: ConsignManager = ConsignManager(x, store, events)
+        schedulers['consign'] = consigns.scheduler
+        await consigns.monitor_consigns() if poller else await consigns.listen_consigns()
 
-    offer_tasks = [start_offer(x) for x in sellers]
-    await asyncio.gather(start_consign(sellers), *offer_tasks)
+    async def start_seller(task: int, account: Account):
+        nonlocal pending
+        try:
+            async with semaphore:
+                s: Session = Session(client=Client.CHROME_120, random_tls_extension_order=True)
+                ua: str = await asyncio.to_thread(lambda: UserAgent().random)
+
+                seller: Seller = Seller(proxies, config, s, ua, account, task)
+                await seller.init()
+        except SellerInitError as e:
+            logger.error(f'Skipping account {account.email}: {e}')
+            return
+        finally:
+            pending -= 1
+            if pending <= 0:
+                consign_ready.set()
+
+        sellers.append(seller)
+        consign_ready.set()
+        try:
+            await asyncio.gather(
+                start_offer(seller, (task - 1) / len(config.accounts)), seller.monitor_listing(), seller.monitor_token()
+            )
+        finally:
+            sellers.remove(seller)
+            schedulers.pop(f'offer:{seller.email}', None)
+
+    def launch(task: int, account: Account):
+        owned[account.email] = task
+        running[account.email] = asyncio.create_task(start_seller(task, account), name=account.email)
+        running[account.email].add_done_callback(stopped)
+
+    def stopped(t: asyncio.Task):
+        if not t.cancelled() and t.exception() is not None:
+            logger.error(f'Account {t.get_name()} stopped: {t.exception()}')
+
+    async def stop_seller(account: Account):
+        owned.pop(account.email, None)
+        t: asyncio.Task | None = running.pop(account.email, None)
+        if t is not None:
+            t.cancel()
+            await asyncio.gather(t, return_exceptions=True)
+            logger.info(f'Stopped account {account.email}')
+
+    async def reload(changed: set[str]):
+        nonlocal config, last_task
+        if proxies.path in changed:
+            proxies.reload()
+        if not changed & {'.env', 'accounts.csv'}:
+            return
+        new: Config | None = Config.reload(config)
+        if new is None:
+            return
+        old, config = config, new
+
+        delays: tuple[float, float, float] = (new.monitor_delay, new.monitor_delay_min, new.monitor_delay_max)
+        if delays != (old.monitor_delay, old.monitor_delay_min, old.monitor_delay_max):
+            for scheduler in schedulers.values():
+                scheduler.configure(*delays)
+            logger.info(f'Applied monitor delay {new.monitor_delay}s to {len(schedulers)} monitors')
+
+        added, removed, updated = diff_accounts(old.accounts, new.accounts)
+        for account in removed:
+            await stop_seller(account)
+        for before, account in updated:
+            if account.email not in owned:
+                continue
+            if account.password != before.password:
+                task: int = owned[account.email]
+                await stop_seller(before)
+                launch(task, account)
+                continue
+            for seller in sellers:
+                if seller.email == account.email:
+                    seller.price_delta = account.price_delta
+                    logger.info(f'Updated price delta of {account.email} to {account.price_delta}')
+        for account in added:
+            if owner(account, shard[1]) == shard[0]:
+                # Task numbers label logs, metrics and stored actions, one in use or stopped earlier is never reused
+                last_task += 1
+                launch(last_task, account)
+                logger.info(f'Started account {account.email}')
+
+    for task, account in accounts:
+        launch(task, account)
+    tasks = [start_consign(sellers), proxies.monitor_stats(), pricing.watch()]
+    tasks.append(FileWatcher(['.env', 'accounts.csv', proxies.path]).watch(reload))
+    if config.metrics_port:
+        tasks.append(metrics.serve(config.metrics_port))
+    if config.metrics_file:
+        tasks.append(metrics.export(config.metrics_file))
+    if config.watchdog_threshold:
+        tasks.append(Watchdog(config.watchdog_threshold).run())
+    profiler: Profiler = Profiler()
+    profiler.install(config.profile_seconds)
+    if config.control_port:
+        tasks.append(profiler.serve(config.control_port, config.profile_seconds))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for t in running.values():
+            t.cancel()
+        await asyncio.gather(*running.values(), return_exceptions=True)
+        await WebHook.close()
+        store.close()
+        Capture.close()
+        Log.flush()
 
 
 if __name__ == '__main__':
@@ -56,6 +233,6 @@ if __name__ == '__main__':
         """
     )
 
-    print('Welcome to the WTN AIO toolbox coded by @Mathious6')
+    logger.print('Welcome to the WTN AIO toolbox coded by @Mathious6')
 
     asyncio.run(main())
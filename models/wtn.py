@@ -1,7 +1,8 @@
 import dataclasses
+import sys
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Offer:
     id: str
     name: str
@@ -15,6 +16,7 @@ class Offer:
     createTime: str
 
     def __post_init__(self):
+        self.size = sys.intern(self.size)
         self.listing_price = int(self.listing_price)
         self.price = int(self.price)
 
@@ -30,14 +32,17 @@ class Offer:
         return f'Offer(id={self.id}, sku={self.sku}, size={self.size}, price={self.price})'
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True, frozen=True)
 class Consign:
     brand: str
     name: str
     id: int
-    sizes: list[str]
+    sizes: tuple[str, ...]
     image: str
 
+    def __post_init__(self):
+        object.__setattr__(self, 'sizes', tuple(sys.intern(size) for size in self.sizes))
+
     def __eq__(self, other):
         if not isinstance(other, Consign):
             return NotImplemented
@@ -50,7 +55,7 @@ class Consign:
         return f'Consign(id={self.id}, sizes={self.sizes})'
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Product:
     name: str
     size: str
@@ -58,6 +63,12 @@ class Product:
     image: str = None
     id: str = None
     price: int = None
+    _hash: int = dataclasses.field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.name = sys.intern(self.name)
+        self.size = sys.intern(self.size)
+        self._hash = hash((self.name, self.size))
 
     def __repr__(self):
         return f'Product(name={self.name}, size={self.size})'
@@ -68,10 +79,13 @@ class Product:
         return self.name == other.name and self.size == other.size
 
     def __hash__(self):
-        return hash(self.name + self.size)
+        return self._hash
 
+    def to_dict(self) -> dict:
+        return {field.name: getattr(self, field.name) for field in dataclasses.fields(self) if field.init}
 
-@dataclasses.dataclass
+
+@dataclasses.dataclass(slots=True)
 class Account:
     email: str
     password: str
@@ -79,3 +93,60 @@ class Account:
 
     def __repr__(self):
         return f'Account(email={self.email}, price_delta={self.price_delta})'
+
+
+class Listing:
+    def __init__(self, products: list[Product] | None = None):
+        self.index: dict[tuple[str, str], list[Product]] = {}
+        self.count: int = 0
+        for product in products or []:
+            self.index.setdefault((product.name, product.size), []).append(product)
+            self.count += 1
+        self._products: list[Product] | None = products or []
+
+    @property
+    def products(self) -> list[Product]:
+        # The index is the source of truth, the flat list is only rebuilt after a removal when it is next read
+        if self._products is None:
+            self._products = [product for products in self.index.values() for product in products]
+        return self._products
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.products)
+
+    def __contains__(self, product: Product):
+        return (product.name, product.size) in self.index
+
+    def __repr__(self):
+        return f'Listing(products={self.count})'
+
+    def find(self, name: str, size: str) -> Product | None:
+        products: list[Product] | None = self.index.get((name, size))
+        return products[0] if products else None
+
+    def remove(self, product: Product) -> None:
+        key: tuple[str, str] = (product.name, product.size)
+        products: list[Product] | None = self.index.get(key)
+        if not products:
+            return
+        for i, p in enumerate(products):
+            if p is product or (p.id is not None and p.id == product.id):
+                del products[i]
+                self.count -= 1
+                self._products = None
+                break
+        if not products:
+            del self.index[key]
+
+    def delta(self, other: 'Listing') -> tuple[list[Product], list[Product], list[Product]]:
+        old: dict[str, Product] = {product.id: product for product in self.products}
+        new: dict[str, Product] = {product.id: product for product in other.products}
+        added: list[Product] = [product for p_id, product in new.items() if p_id not in old]
+        removed: list[Product] = [product for p_id, product in old.items() if p_id not in new]
+        changed: list[Product] = [
+            product for p_id, product in new.items() if p_id in old and old[p_id].price != product.price
+        ]
+        return added, removed, changed
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from utils.log import Log, LogLevel
+
+logger = Log('Cache', LogLevel.DEBUG)
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize: int = maxsize
+        self.ttl: float = ttl
+        self.data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key: Hashable):
+        return self.get(key) is not None
+
+    def get(self, key: Hashable) -> Any | None:
+        entry: tuple[float, Any] | None = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self.data[key]
+            return None
+        self.data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, expires_at: float | None = None) -> None:
+        self.data[key] = (expires_at or time.time() + self.ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Any | None:
+        entry: tuple[float, Any] | None = self.data.pop(key, None)
+        return entry[1] if entry else None
+
+
+class VariantCache(TTLCache):
+    def __init__(self, path: str, maxsize: int = 4096, ttl: float = 86400):
+        super().__init__(maxsize, ttl)
+        self.path: str = path
+        self.dirty: bool = False
+        self.writer: asyncio.Task | None = None
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(file=self.path, mode='r', encoding='utf-8') as f:
+                entries: list = json.load(f)
+        except FileNotFoundError:
+            return
+        except (ValueError, OSError) as e:
+            logger.warning(f'Ignoring unreadable variant cache {self.path}: {e}')
+            return
+
+        now: float = time.time()
+        for c_id, expires_at, variants in entries:
+            if expires_at > now:
+                self.set(c_id, variants, expires_at)
+        logger.debug(f'Loaded {len(self)} products from variant cache')
+
+    async def save(self, delay: float = 1) -> None:
+        # One writer at a time, saves requested while it waits or writes are coalesced into its next pass
+        self.dirty = True
+        if self.writer is not None and not self.writer.done():
+            return
+        self.writer = asyncio.current_task()
+        while self.dirty:
+            await asyncio.sleep(delay)
+            self.dirty = False
+            entries: list = [[c_id, expires_at, variants] for c_id, (expires_at, variants) in self.data.items()]
+            await asyncio.to_thread(self._write, entries)
+
+    def _write(self, entries: list) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode='w', encoding='utf-8') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f'Error while saving variant cache: {e}')
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
@@ -18,4 +18,6 @@ class ReCaptchaV3:
         ) if proxy else None
 
     def solve(self) -> reCaptchaV3:
+        if not self.anchor_url:
+            return ''
         return reCaptchaV3(anchor_url=self.anchor_url, timeout=self.timeout, proxy=self.proxy)
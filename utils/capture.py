@@ -0,0 +1,199 @@
+import asyncio
+import gzip
+import json
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from queue import SimpleQueue
+from typing import Any, Iterator
+from urllib.parse import urlencode, urlsplit
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+from utils.log import Log, LogLevel
+from utils.metrics import endpoint
+
+logger = Log('Capture', LogLevel.DEBUG)
+
+REDACTED: str = '<redacted>'
+SECRET_HEADERS: set[str] = {'authorization', 'cookie', 'set-cookie', 'proxy-authorization'}
+# Keys are matched case-insensitively on their end, paymentInfoUuid, addressUuid, IBAN and csrfToken all are secret
+SECRET_SUFFIXES: tuple[str, ...] = (
+    'password', 'email', 'firstname', 'lastname', 'fullname', 'username', 'phone', 'iban', 'uuid', 'token', 'address',
+    'street', 'city', 'zipcode', 'postalcode', 'postcode'
+)
+# Cache busters change on every poll, a replayed poll would never match its captured request with them
+VOLATILE_PARAMS: set[str] = {'nocache'}
+
+
+@lru_cache(maxsize=1024)
+def secret(key: str) -> bool:
+    return key.lower().endswith(SECRET_SUFFIXES)
+
+
+def redact(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: REDACTED if secret(key) else redact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    return value
+
+
+def redact_headers(headers: Any) -> dict[str, str]:
+    return {key: REDACTED if key.lower() in SECRET_HEADERS else value for key, value in dict(headers or {}).items()}
+
+
+def read(path: str) -> Iterator[dict]:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class Capture:
+    active: 'Capture | None' = None
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self.file = gzip.open(path, 'at', encoding='utf-8')
+        self.start: float = time.perf_counter()
+        self.count: int = 0
+        self.queue: SimpleQueue = SimpleQueue()
+        self.thread: threading.Thread = threading.Thread(target=self._run, name='capture', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def open(cls, path: str) -> None:
+        cls.active = cls(path)
+        logger.warning(f'Capturing API traffic to {path}')
+
+    @classmethod
+    def close(cls) -> None:
+        if cls.active is not None:
+            cls.active.queue.put(None)
+            cls.active.thread.join(timeout=5)
+            cls.active.file.close()
+            logger.info(f'Captured {cls.active.count} requests to {cls.active.path}')
+            cls.active = None
+
+    def record(
+            self, method: str, url: str, kwargs: dict, started: float, elapsed: float, r: Response | None = None,
+            error: Exception | None = None
+    ) -> None:
+        # Parsing, redaction and compression happen in the writer thread, a request only pays for the queue put
+        params: dict | None = kwargs.get('params')
+        params = dict(params) if params else params
+        self.queue.put((method, url, params, kwargs.get('json'), started, elapsed, r, error))
+
+    def _run(self) -> None:
+        while True:
+            item: tuple | None = self.queue.get()
+            if item is None:
+                return
+            try:
+                self.write(*item)
+            except (OSError, ValueError) as e:
+                logger.error(f'Error while writing capture: {e}')
+
+    def write(
+            self, method: str, url: str, params: dict | None, body: Any, started: float, elapsed: float,
+            r: Response | None, error: Exception | None
+    ) -> None:
+        entry: dict = {
+            't': round(started - self.start, 6),
+            'elapsed': round(elapsed, 6),
+            'method': method.upper(),
+            'url': url,
+            'params': params,
+            'json': redact(body),
+        }
+        if error is not None:
+            entry['error'] = str(error)
+        else:
+            entry['status'] = r.status_code
+            entry['headers'] = redact_headers(r.headers)
+            try:
+                entry['body'] = redact(json.loads(r.content))
+            except ValueError:
+                entry['text'] = r.content.decode(errors='replace')
+        self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self.count += 1
+
+
+class Replay:
+    active: 'Replay | None' = None
+
+    def __init__(self, path: str, paced: bool = False, until: tuple[str, ...] = ()):
+        self.path: str = path
+        self.paced: bool = paced
+        self.until: tuple[str, ...] = until
+        self.queues: dict[str, deque[dict]] = {}
+        self.last: dict[str, dict] = {}
+        self.fallback: dict[str, dict] = {}
+        self.served: dict[str, int] = {}
+        self.polls: int = 0
+        self.origin: float | None = None
+        self.start: float = 0
+        self.done: asyncio.Event = asyncio.Event()
+
+        for entry in read(path):
+            self.queues.setdefault(self.key(entry['method'], entry['url'], entry['params']), deque()).append(entry)
+            self.fallback.setdefault(f'{entry["method"]} {endpoint(entry["url"])}', entry)
+            self.polls += self.awaited(entry)
+        logger.info(f'Loaded {sum(map(len, self.queues.values()))} requests from {path}')
+
+    @staticmethod
+    def key(method: str, url: str, params: dict | None) -> str:
+        query: list[tuple[str, Any]] = sorted(item for item in (params or {}).items() if item[0] not in VOLATILE_PARAMS)
+        return f'{method.upper()} {urlsplit(url).path}?{urlencode(query)}'
+
+    def awaited(self, entry: dict) -> bool:
+        # The replay is over once the monitors have been served every captured poll, actions depend on the build
+        return entry['method'] == 'GET' and (not self.until or endpoint(entry['url']) in self.until)
+
+    def next(self, method: str, url: str, params: dict | None) -> dict | None:
+        # Every recorded response is served once in order, a request that outlives the capture gets the last one again
+        key: str = self.key(method, url, params)
+        queue: deque[dict] | None = self.queues.get(key)
+        if not queue:
+            return self.last.get(key) or self.fallback.get(f'{method.upper()} {endpoint(url)}')
+        entry: dict = queue.popleft()
+        self.last[key] = entry
+        if self.awaited(entry):
+            self.polls -= 1
+            if not self.polls:
+                self.done.set()
+        return entry
+
+    async def request(self, method: str, url: str, params: dict | None = None, **_) -> Response:
+        entry: dict | None = self.next(method, url, params)
+        path: str = f'{method.upper()} {endpoint(url)}'
+        self.served[path] = self.served.get(path, 0) + 1
+        if entry is None:
+            return self.response(404, {}, {'message': 'Not captured'})
+        if self.paced:
+            if self.origin is None:
+                self.origin, self.start = entry['t'], time.monotonic()
+            await asyncio.sleep(max(0.0, self.start + entry['t'] - self.origin + entry['elapsed'] - time.monotonic()))
+        if 'error' in entry:
+            raise ConnectionError(entry['error'])
+        return self.response(entry['status'], entry['headers'], entry.get('body'), entry.get('text'))
+
+    @staticmethod
+    def response(status: int, headers: dict, body: Any = None, text: str | None = None) -> Response:
+        r: Response = Response()
+        r.status_code = status
+        r.headers = CaseInsensitiveDict(headers)
+        r._content = text.encode() if text is not None else json.dumps(body).encode()
+        return r
+
+    async def get(self, url: str, **kwargs) -> Response:
+        return await self.request('get', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> Response:
+        return await self.request('post', url, **kwargs)
+
+    async def delete(self, url: str, **kwargs) -> Response:
+        return await self.request('delete', url, **kwargs)
@@ -10,19 +10,60 @@ from utils.log import Log, LogLevel
 load_dotenv()
 logger = Log('Config', LogLevel.DEBUG)
 
+# Bound at startup by files, ports, processes or sessions, a reload keeps the running values of these
+RESTART_ONLY: tuple[str, ...] = (
+    'workers', 'init_concurrency', 'metrics_port', 'metrics_file', 'log_file', 'state_db', 'pricing_rules',
+    'capture_file', 'watchdog_threshold', 'control_port', 'variant_cache', 'log_level', 'webhook_success',
+    'webhook_monitor', 'monitor_timeout', 'consign_concurrency', 'offer_concurrency', 'listing_refresh',
+    'session_listing_ttl', 'variant_cache_ttl'
+)
+
 
 class Config:
     def __init__(self):
         self.monitor_delay: float = 5
+        self.monitor_delay_min: float = 5
+        self.monitor_delay_max: float = 5
         self.monitor_timeout: float = 10
         self.webhook_success: str | None = None
         self.webhook_monitor: str | None = None
         self.log_level: int = 0
+        self.consign_concurrency: int = 4
+        self.offer_concurrency: int = 100
+        self.init_concurrency: int = 5
+        self.session_listing_ttl: float = 600
+        self.listing_refresh: float = 300
+        self.metrics_port: int | None = None
+        self.metrics_file: str | None = None
+        self.log_file: str | None = None
+        self.state_db: str = 'state.db'
+        self.pricing_rules: str = 'rules.json'
+        self.workers: int = 1
+        self.variant_cache_ttl: float = 86400
+        self.variant_cache: str = 'variants.json'
+        self.capture_file: str | None = None
+        self.watchdog_threshold: float = 0.25
+        self.profile_seconds: float = 30
+        self.control_port: int | None = None
 
         self.accounts: list[Account] = []
 
         self.get_env()
 
+    @classmethod
+    def reload(cls, current: 'Config') -> 'Config | None':
+        load_dotenv(override=True)
+        try:
+            config: Config = cls()
+        except SystemExit:
+            logger.error('Invalid configuration, keeping the current one')
+            return None
+        for name in RESTART_ONLY:
+            if getattr(config, name) != getattr(current, name):
+                logger.warning(f'{name.upper()} changed, restart to apply it')
+            setattr(config, name, getattr(current, name))
+        return config
+
     @staticmethod
     def get_env_variable(var_name: str, is_secret: bool = False, optional: bool = False) -> str | None:
         value: str = os.getenv(var_name)
@@ -56,14 +97,37 @@ class Config:
     def get_env(self):
         try:
             self.monitor_delay: float = float(self.get_env_variable('MONITOR_DELAY'))
+            self.monitor_delay_min: float = float(
+                self.get_env_variable('MONITOR_DELAY_MIN', optional=True) or self.monitor_delay
+            )
+            self.monitor_delay_max: float = float(
+                self.get_env_variable('MONITOR_DELAY_MAX', optional=True) or self.monitor_delay
+            )
             self.monitor_timeout: float = float(self.get_env_variable('MONITOR_TIMEOUT'))
             self.webhook_success: str = self.get_env_variable('WEBHOOK_SUCCESS')
             self.webhook_monitor: str = self.get_env_variable('WEBHOOK_MONITOR', optional=True)
             self.log_level: int = int(self.get_env_variable('LOG_LEVEL', optional=True) or 0)
+            self.consign_concurrency: int = int(self.get_env_variable('CONSIGN_CONCURRENCY', optional=True) or 4)
+            self.offer_concurrency: int = int(self.get_env_variable('OFFER_CONCURRENCY', optional=True) or 100)
+            self.init_concurrency: int = int(self.get_env_variable('INIT_CONCURRENCY', optional=True) or 5)
+            self.session_listing_ttl: float = float(self.get_env_variable('SESSION_LISTING_TTL', optional=True) or 600)
+            self.listing_refresh: float = float(self.get_env_variable('LISTING_REFRESH', optional=True) or 300)
+            self.metrics_port: int = int(self.get_env_variable('METRICS_PORT', optional=True) or 0) or None
+            self.metrics_file: str = self.get_env_variable('METRICS_FILE', optional=True)
+            self.log_file: str = self.get_env_variable('LOG_FILE', optional=True)
+            self.state_db: str = self.get_env_variable('STATE_DB', optional=True) or 'state.db'
+            self.pricing_rules: str = self.get_env_variable('PRICING_RULES', optional=True) or 'rules.json'
+            self.workers: int = int(self.get_env_variable('WORKERS', optional=True) or 1) or os.cpu_count()
+            self.variant_cache_ttl: float = float(self.get_env_variable('VARIANT_CACHE_TTL', optional=True) or 86400)
+            self.variant_cache: str = self.get_env_variable('VARIANT_CACHE', optional=True) or 'variants.json'
+            self.capture_file: str = self.get_env_variable('CAPTURE_FILE', optional=True)
+            self.watchdog_threshold: float = float(self.get_env_variable('WATCHDOG_THRESHOLD', optional=True) or 0.25)
+            self.profile_seconds: float = float(self.get_env_variable('PROFILE_SECONDS', optional=True) or 30)
+            self.control_port: int = int(self.get_env_variable('CONTROL_PORT', optional=True) or 0) or None
 
             self.accounts = self.get_accounts('accounts.csv')
 
-            print()
+            logger.print()
         except ValueError as e:
             logger.error(f'Error in get_env: {e}')
             logger.exception()
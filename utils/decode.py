@@ -0,0 +1,52 @@
+from typing import Any
+
+from requests import Response
+
+from models.wtn import Consign, Offer, Product
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+
+def body(r: Response) -> Any:
+    return loads(r.content)
+
+
+def offer(result: dict) -> Offer:
+    return Offer(
+        result['id'],
+        result['name'],
+        result['variantId'],
+        result['sku'],
+        result['brand'],
+        result['image'],
+        result['europeanSize'],
+        result['listingPrice'],
+        result['price'],
+        result['createTime'],
+    )
+
+
+def product(result: dict) -> Product:
+    item: dict = result['product']
+    return Product(item['name'], item['europeanSize'], None, item['image'], result['name'], result['price'])
+
+
+def products(results: list[dict]) -> list[Product]:
+    return [product(result) for result in results]
+
+
+def consign(result: dict) -> Consign:
+    return Consign(
+        brand=result['brand'],
+        name=result['name'],
+        id=result['id'],
+        sizes=result['sizes'],
+        image=result['image'],
+    )
+
+
+def variants(data: dict) -> dict[str, int]:
+    return {variant['europeanSize']: variant['id'] for variant in data['variants']}
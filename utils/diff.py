@@ -0,0 +1,79 @@
+import dataclasses
+
+from models.wtn import Consign
+from utils import decode
+
+
+@dataclasses.dataclass
+class ConsignAdded:
+    consign: Consign
+
+
+@dataclasses.dataclass
+class ConsignRemoved:
+    consign: Consign
+
+
+@dataclasses.dataclass
+class ConsignChanged:
+    consign: Consign
+    added_sizes: frozenset[str]
+    removed_sizes: frozenset[str]
+
+
+ConsignEvent = ConsignAdded | ConsignRemoved | ConsignChanged
+
+
+class ConsignDiff:
+    def __init__(self):
+        self.slots: dict[int, tuple[frozenset[str], Consign]] = {}
+        self.previous: dict[int, tuple[frozenset[str], Consign]] = {}
+        self.current: dict[int, tuple[frozenset[str], Consign]] = {}
+
+    def __len__(self):
+        return len(self.slots) + len(self.current)
+
+    def reset(self, results: list[dict]) -> None:
+        self.slots = {result['id']: (frozenset(result['sizes']), decode.consign(result)) for result in results}
+
+    def snapshot(self) -> list[Consign]:
+        return [consign for _, consign in self.slots.values()]
+
+    def begin(self) -> None:
+        self.previous, self.current = self.slots, {}
+
+    def feed(self, results: list[dict]) -> list[ConsignEvent]:
+        events: list[ConsignEvent] = []
+        previous: dict[int, tuple[frozenset[str], Consign]] = self.previous
+        current: dict[int, tuple[frozenset[str], Consign]] = self.current
+
+        for result in results:
+            c_id: int = result['id']
+            if c_id in current:
+                continue
+            sizes: frozenset[str] = frozenset(result['sizes'])
+            seen: tuple[frozenset[str], Consign] | None = previous.pop(c_id, None)
+            if seen is None:
+                consign: Consign = decode.consign(result)
+                current[c_id] = (sizes, consign)
+                events.append(ConsignAdded(consign))
+            elif seen[0] != sizes:
+                consign: Consign = decode.consign(result)
+                current[c_id] = (sizes, consign)
+                events.append(ConsignChanged(consign, sizes - seen[0], seen[0] - sizes))
+            else:
+                current[c_id] = seen
+        return events
+
+    def finish(self) -> list[ConsignEvent]:
+        events: list[ConsignEvent] = [ConsignRemoved(consign) for _, consign in self.previous.values()]
+        self.slots, self.previous, self.current = self.current, {}, {}
+        return events
+
+    def abort(self) -> None:
+        self.slots, self.previous, self.current = self.previous | self.current, {}, {}
+
+    def diff(self, results: list[dict]) -> list[ConsignEvent]:
+        self.begin()
+        events: list[ConsignEvent] = self.feed(results)
+        return events + self.finish()
@@ -0,0 +1,39 @@
+from hashlib import blake2b
+
+from requests import Response
+
+from utils.metrics import FINGERPRINTS
+
+VALIDATORS: tuple[str, ...] = ('ETag', 'Last-Modified')
+
+
+class Fingerprint:
+    def __init__(self, name: str):
+        self.name: str = name
+        self.pages: dict[int, tuple[bytes, list, int | None]] = {}
+
+    @staticmethod
+    def digest(r: Response) -> bytes:
+        h = blake2b(r.content, digest_size=16)
+        for header in VALIDATORS:
+            value: str | None = r.headers.get(header)
+            if value:
+                h.update(value.encode())
+        return h.digest()
+
+    def get(self, key: int, digest: bytes) -> tuple[list, int | None] | None:
+        page: tuple[bytes, list, int | None] | None = self.pages.get(key)
+        if page is None or page[0] != digest:
+            FINGERPRINTS.inc(self.name, 'miss')
+            return None
+        FINGERPRINTS.inc(self.name, 'hit')
+        return page[1], page[2]
+
+    def set(self, key: int, digest: bytes, results: list, total: int | None) -> None:
+        self.pages[key] = (digest, results, total)
+
+    def skip(self) -> None:
+        FINGERPRINTS.inc(self.name, 'skip')
+
+    def reset(self) -> None:
+        self.pages.clear()
@@ -0,0 +1,64 @@
+import time
+from typing import Awaitable, Callable
+
+from noble_tls import Session
+from requests import Response
+
+from utils.capture import Capture, Replay
+from utils.metrics import endpoint, REQUEST_LATENCY, REQUESTS, CACHE_STATUS
+from utils.proxy import Proxies, Proxy
+from utils.retry import classify, PROXY_FAILURE_CODES
+
+
+class HttpClient:
+    def __init__(self, session: Session, proxies: Proxies, task: int | None = None):
+        self.s: Session = session
+        self.proxies: Proxies = proxies
+        self.task: int | None = task
+        self.on_unauthorized: Callable[[str | None], Awaitable[bool]] | None = None
+
+    async def request(self, method: str, url: str, reauth: bool = True, **kwargs) -> Response:
+        authorization: str | None = self.s.headers.get('authorization')
+        r: Response = await self._send(method, url, **kwargs)
+        # A 401 is retried once with the refreshed token, the callback waits for a refresh already in flight
+        if r.status_code == 401 and reauth and self.on_unauthorized is not None:
+            if await self.on_unauthorized(authorization):
+                r = await self._send(method, url, **kwargs)
+        return r
+
+    async def _send(self, method: str, url: str, **kwargs) -> Response:
+        proxy: Proxy = self.proxies.pick()
+        transport: Session | Replay = Replay.active or self.s
+        start: float = time.perf_counter()
+        try:
+            r: Response = await getattr(transport, method)(url=url, proxy=proxy.url, **kwargs)
+        except Exception as e:
+            self._record(method, url, proxy, time.perf_counter() - start, 'error')
+            proxy.record(time.perf_counter() - start, False)
+            if Capture.active is not None:
+                Capture.active.record(method, url, kwargs, start, time.perf_counter() - start, error=e)
+            raise classify(e, transport=True) from e
+        elapsed: float = time.perf_counter() - start
+        if Capture.active is not None:
+            Capture.active.record(method, url, kwargs, start, elapsed, r)
+        proxy.record(elapsed, r.status_code not in PROXY_FAILURE_CODES)
+        self._record(method, url, proxy, elapsed, r.status_code)
+
+        cache_status: str | None = r.headers.get('Cf-Cache-Status')
+        if cache_status:
+            CACHE_STATUS.inc(endpoint(url), cache_status)
+        return r
+
+    def _record(self, method: str, url: str, proxy: Proxy, elapsed: float, status: int | str) -> None:
+        path: str = endpoint(url)
+        REQUEST_LATENCY.observe(elapsed, path, method, self.task, proxy.name, status)
+        REQUESTS.inc(path, method, self.task, status)
+
+    async def get(self, url: str, **kwargs) -> Response:
+        return await self.request('get', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> Response:
+        return await self.request('post', url, **kwargs)
+
+    async def delete(self, url: str, **kwargs) -> Response:
+        return await self.request('delete', url, **kwargs)
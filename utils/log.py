@@ -1,5 +1,13 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
 import traceback
 from datetime import datetime
+from queue import SimpleQueue, Empty
+from typing import Any, Callable
 
 from colorama import Fore, Style
 
@@ -13,6 +21,109 @@ class LogLevel:
     CRITICAL: int = 5
 
 
+LEVEL_NAMES: dict[int, str] = {
+    LogLevel.DEBUG: 'debug',
+    LogLevel.INFO: 'info',
+    LogLevel.SUCCESS: 'success',
+    LogLevel.WARNING: 'warning',
+    LogLevel.ERROR: 'error',
+    LogLevel.CRITICAL: 'critical',
+}
+
+
+class JsonSink:
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backups: int = 5):
+        self.path: str = path
+        self.max_bytes: int = max_bytes
+        self.backups: int = backups
+        self.file = open(file=path, mode='a', encoding='utf-8')
+        self.size: int = self.file.tell()
+
+    def write(self, lines: list[str]) -> None:
+        data: str = ''.join(lines)
+        if self.size + len(data) > self.max_bytes:
+            self.rotate()
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+
+    def rotate(self) -> None:
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        if self.backups:
+            os.replace(self.path, f'{self.path}.1')
+        self.file = open(file=self.path, mode='w', encoding='utf-8')
+        self.size = 0
+
+
+class Writer(threading.Thread):
+    def __init__(self):
+        super().__init__(name='log-writer', daemon=True)
+        self.queue: SimpleQueue = SimpleQueue()
+        self.json_sink: JsonSink | None = None
+
+    def run(self) -> None:
+        while True:
+            batch: list = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            self.write(batch)
+
+    def write(self, batch: list) -> None:
+        console: list[str] = []
+        records: list[str] = []
+        for record in batch:
+            if isinstance(record, threading.Event):
+                self.emit(console, records)
+                console, records = [], []
+                record.set()
+                continue
+
+            created, level, name, task_number, message, args, line_before, line_after = record
+            if level is None:
+                console.append(f'{message}\n')
+                continue
+
+            try:
+                text: str = message() if callable(message) else (message % args if args else message)
+            except Exception as e:
+                text = f'{message!r} (format error: {e})'
+
+            timestamp: str = datetime.fromtimestamp(created).strftime('%H:%M:%S.%f')
+            task_str: str = f'[{task_number}] ' if task_number is not None else ''
+            color: str = Log.COLORS.get(level, Fore.WHITE)
+            console.append(
+                ('\n' if line_before else '')
+                + f'{color}[{timestamp}] [{name}] {task_str}{text}{Style.RESET_ALL}\n'
+                + ('\n' if line_after else '')
+            )
+            if self.json_sink is not None:
+                records.append(json.dumps({
+                    'time': created,
+                    'level': LEVEL_NAMES.get(level, level),
+                    'name': name,
+                    'task': task_number,
+                    'message': text,
+                }) + '\n')
+
+        self.emit(console, records)
+
+    def emit(self, console: list[str], records: list[str]) -> None:
+        if console:
+            sys.stdout.write(''.join(console))
+            sys.stdout.flush()
+        if records:
+            try:
+                self.json_sink.write(records)
+            except OSError as e:
+                sys.stderr.write(f'Error while writing log file: {e}\n')
+
+
 class Log:
     COLORS = {
         LogLevel.DEBUG: Fore.WHITE,
@@ -23,44 +134,85 @@ class Log:
         LogLevel.CRITICAL: Fore.LIGHTRED_EX
     }
 
+    _writer: Writer | None = None
+    _writer_lock: threading.Lock = threading.Lock()
+    _instances: dict[tuple[str, int | None], 'Log'] = {}
+
     def __init__(self, name: str, level: int = LogLevel.DEBUG, task_number: int | None = None):
         self.name: str = name.upper()
         self.level: int = level
         self.task_number: int | None = task_number
 
-    def _log(self, level: int, message: str, line_before: int = 0, line_after: int = 0):
+    @classmethod
+    def get(cls, name: str, level: int = LogLevel.DEBUG, task_number: int | None = None) -> 'Log':
+        key: tuple[str, int | None] = (name.upper(), task_number)
+        log: Log | None = cls._instances.get(key)
+        if log is None:
+            log = cls._instances[key] = cls(name, level, task_number)
+        log.level = level
+        return log
+
+    @classmethod
+    def writer(cls) -> Writer:
+        if cls._writer is None:
+            with cls._writer_lock:
+                if cls._writer is None:
+                    cls._writer = Writer()
+                    cls._writer.start()
+                    atexit.register(cls.flush)
+        return cls._writer
+
+    @classmethod
+    def configure_file(cls, path: str, max_bytes: int = 10 * 1024 * 1024, backups: int = 5) -> None:
+        cls.writer().json_sink = JsonSink(path, max_bytes, backups)
+
+    @classmethod
+    def flush(cls, timeout: float = 2) -> None:
+        if cls._writer is None or not cls._writer.is_alive():
+            return
+        done: threading.Event = threading.Event()
+        cls._writer.queue.put(done)
+        done.wait(timeout)
+
+    def _log(
+            self, level: int, message: str | Callable[[], str], args: tuple[Any, ...],
+            line_before: int = 0, line_after: int = 0
+    ):
         if self.level <= level:
-            print() if line_before else None
-            timestamp = datetime.now().strftime('%H:%M:%S.%f')
-            task_str = f"[{self.task_number}] " if self.task_number is not None else ""
-            color = self.COLORS.get(level, Fore.WHITE)
-            print(f'{color}[{timestamp}] [{self.name}] {task_str}{message}{Style.RESET_ALL}')
-            print() if line_after else None
+            self.writer().queue.put(
+                (time.time(), level, self.name, self.task_number, message, args, line_before, line_after)
+            )
+
+    def _raw(self, message: str) -> None:
+        self.writer().queue.put((time.time(), None, self.name, self.task_number, message, (), 0, 0))
 
     def title(self, message: str, line_before: int = 0, line_after: int = 0):
         if self.level <= LogLevel.INFO:
-            print() if line_before else None
-            print(f"{Fore.BLUE}{message}{Style.RESET_ALL}")
-            print() if line_after else None
+            before: str = '\n' if line_before else ''
+            after: str = '\n' if line_after else ''
+            self._raw(f'{before}{Fore.BLUE}{message}{Style.RESET_ALL}{after}')
+
+    def print(self, message: str = ''):
+        self._raw(message)
 
-    def debug(self, message: str, line_before: int = 0, line_after: int = 0):
-        self._log(LogLevel.DEBUG, message, line_before, line_after)
+    def debug(self, message: str | Callable[[], str], *args, line_before: int = 0, line_after: int = 0):
+        self._log(LogLevel.DEBUG, message, args, line_before, line_after)
 
-    def info(self, message: str, line_before: int = 0, line_after: int = 0):
-        self._log(LogLevel.INFO, message, line_before, line_after)
+    def info(self, message: str | Callable[[], str], *args, line_before: int = 0, line_after: int = 0):
+        self._log(LogLevel.INFO, message, args, line_before, line_after)
 
-    def success(self, message: str, line_before: int = 0, line_after: int = 0):
-        self._log(LogLevel.SUCCESS, message, line_before, line_after)
+    def success(self, message: str | Callable[[], str], *args, line_before: int = 0, line_after: int = 0):
+        self._log(LogLevel.SUCCESS, message, args, line_before, line_after)
 
-    def warning(self, message: str, line_before: int = 0, line_after: int = 0):
-        self._log(LogLevel.WARNING, message, line_before, line_after)
+    def warning(self, message: str | Callable[[], str], *args, line_before: int = 0, line_after: int = 0):
+        self._log(LogLevel.WARNING, message, args, line_before, line_after)
 
-    def error(self, message: str, line_before: int = 0, line_after: int = 0):
-        self._log(LogLevel.ERROR, message, line_before, line_after)
+    def error(self, message: str | Callable[[], str], *args, line_before: int = 0, line_after: int = 0):
+        self._log(LogLevel.ERROR, message, args, line_before, line_after)
 
-    def critical(self, message: str, line_before: int = 0, line_after: int = 0):
-        self._log(LogLevel.CRITICAL, message, line_before, line_after)
+    def critical(self, message: str | Callable[[], str], *args, line_before: int = 0, line_after: int = 0):
+        self._log(LogLevel.CRITICAL, message, args, line_before, line_after)
 
     def exception(self):
         if self.level <= LogLevel.DEBUG:
-            print(f'{Fore.RED}{traceback.format_exc()}{Style.RESET_ALL}')
+            self._raw(f'{Fore.RED}{traceback.format_exc()}{Style.RESET_ALL}')
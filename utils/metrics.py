@@ -0,0 +1,171 @@
+import asyncio
+import json
+import re
+import time
+from bisect import bisect_left
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+from utils.log import Log, LogLevel
+
+logger = Log('Metrics', LogLevel.DEBUG)
+
+BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ID_SEGMENT: re.Pattern = re.compile(r'/(\d+|[0-9a-fA-F-]{16,})(?=/|$)')
+
+
+@lru_cache(maxsize=1024)
+def endpoint(url: str) -> str:
+    return ID_SEGMENT.sub('/{id}', urlsplit(url).path) or '/'
+
+
+class Counter:
+    def __init__(self, name: str, description: str, labels: tuple[str, ...]):
+        self.name: str = name
+        self.description: str = description
+        self.labels: tuple[str, ...] = labels
+        self.series: dict[tuple, float] = {}
+
+    def inc(self, *values, amount: float = 1) -> None:
+        self.series[values] = self.series.get(values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines: list[str] = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        for values, total in self.series.items():
+            lines.append(f'{self.name}{{{format_labels(self.labels, values)}}} {total}')
+        return lines
+
+    def snapshot(self) -> list[dict]:
+        return [{**dict(zip(self.labels, values)), 'value': total} for values, total in self.series.items()]
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, labels: tuple[str, ...], buckets: tuple[float, ...] = BUCKETS):
+        self.name: str = name
+        self.description: str = description
+        self.labels: tuple[str, ...] = labels
+        self.buckets: tuple[float, ...] = buckets
+        self.series: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, *values) -> None:
+        series: list[float] | None = self.series.get(values)
+        if series is None:
+            series = self.series[values] = [0] * (len(self.buckets) + 3)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def quantile(self, series: list[float], q: float) -> float | None:
+        count: float = series[-1]
+        if not count:
+            return None
+        rank: float = q * count
+        seen: float = 0
+        for i, bound in enumerate(self.buckets):
+            seen += series[i]
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def render(self) -> list[str]:
+        lines: list[str] = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for values, series in self.series.items():
+            labels: str = format_labels(self.labels, values)
+            cumulative: float = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series[-2]}')
+            lines.append(f'{self.name}_count{{{labels}}} {series[-1]}')
+        return lines
+
+    def snapshot(self) -> list[dict]:
+        return [
+            {
+                **dict(zip(self.labels, values)),
+                'count': series[-1],
+                'sum': round(series[-2], 6),
+                'p50': self.quantile(series, 0.5),
+                'p99': self.quantile(series, 0.99),
+            } for values, series in self.series.items()
+        ]
+
+
+def format_labels(names: tuple[str, ...], values: tuple) -> str:
+    return ','.join(f'{name}="{str(value).replace(chr(34), "")}"' for name, value in zip(names, values))
+
+
+class Metrics:
+    def __init__(self):
+        self.metrics: list[Counter | Histogram] = []
+
+    def counter(self, name: str, description: str, labels: tuple[str, ...] = ()) -> Counter:
+        metric: Counter = Counter(name, description, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, description: str, labels: tuple[str, ...] = ()) -> Histogram:
+        metric: Histogram = Histogram(name, description, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+    def snapshot(self) -> dict:
+        return {'time': time.time(), **{metric.name: metric.snapshot() for metric in self.metrics}}
+
+    async def serve(self, port: int, host: str = '127.0.0.1') -> None:
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            try:
+                await reader.readuntil(b'\r\n\r\n')
+                body: bytes = self.render().encode()
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                    b'Content-Length: %d\r\nConnection: close\r\n\r\n%b' % (len(body), body)
+                )
+                await writer.drain()
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        server: asyncio.Server = await asyncio.start_server(handle, host, port)
+        logger.info(f'Serving metrics on http://{host}:{port}/metrics')
+        async with server:
+            await server.serve_forever()
+
+    async def export(self, path: str, interval: float = 15) -> None:
+        def write(line: str) -> None:
+            with open(file=path, mode='a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(write, json.dumps(self.snapshot()))
+            except OSError as e:
+                logger.error(f'Error while writing metrics: {e}')
+
+
+metrics: Metrics = Metrics()
+
+REQUEST_LATENCY: Histogram = metrics.histogram(
+    'wtn_request_seconds', 'Latency of API requests', ('endpoint', 'method', 'task', 'proxy', 'status')
+)
+REQUESTS: Counter = metrics.counter('wtn_requests_total', 'API requests sent', ('endpoint', 'method', 'task', 'status'))
+CACHE_STATUS: Counter = metrics.counter(
+    'wtn_cache_status_total', 'Cf-Cache-Status of API responses', ('endpoint', 'cache')
+)
+POLL_INTERVAL: Histogram = metrics.histogram('wtn_poll_interval_seconds', 'Time between two polls', ('monitor',))
+DETECTION_TO_ACTION: Histogram = metrics.histogram(
+    'wtn_detection_to_action_seconds', 'Time between detecting an event and sending the action', ('action',)
+)
+OFFERS: Counter = metrics.counter('wtn_offers_total', 'Offers handled, by outcome', ('status',))
+FINGERPRINTS: Counter = metrics.counter(
+    'wtn_fingerprint_total', 'Poll pages reused unparsed (hit) or parsed (miss), and skipped polls',
+    ('monitor', 'result')
+)
+LOOP_LAG: Histogram = metrics.histogram('wtn_event_loop_lag_seconds', 'Delay of event-loop heartbeats')
+LOOP_STALLS: Counter = metrics.counter('wtn_event_loop_stalls_total', 'Callbacks that blocked the event loop too long')
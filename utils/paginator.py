@@ -0,0 +1,105 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable
+
+from requests import Response
+
+from utils.decode import body
+from utils.fingerprint import Fingerprint
+from utils.retry import HttpError
+
+
+class PageError(HttpError):
+    def __init__(self, status_code: int):
+        super().__init__(status_code, f'Failed to fetch page, status code: {status_code}')
+
+
+class Paginator:
+    TOTAL_KEYS: tuple[str, ...] = ('total', 'totalCount', 'count', 'totalResults')
+
+    def __init__(
+            self, fetch: Callable[[dict], Awaitable[Response]], take: int = 100, concurrency: int = 4,
+            parse: Callable[[list[dict]], list] | None = None, fingerprint: Fingerprint | None = None
+    ):
+        self.fetch: Callable[[dict], Awaitable[Response]] = fetch
+        self.take: int = take
+        self.concurrency: int = concurrency
+        self.parse: Callable[[list[dict]], list] | None = parse
+        self.fingerprint: Fingerprint | None = fingerprint
+        self.first: Response | None = None
+        self.total: int | None = None
+        self.changed: bool = fingerprint is None
+
+    async def _page(self, skip: int) -> list[dict]:
+        r: Response = await self.fetch({'take': self.take, 'skip': skip})
+        if r.status_code != 200:
+            raise PageError(r.status_code)
+
+        digest: bytes | None = None
+        if self.fingerprint is not None:
+            digest = self.fingerprint.digest(r)
+            cached: tuple[list, int | None] | None = self.fingerprint.get(skip, digest)
+            if cached is not None:
+                if skip == 0:
+                    self.first, self.total = r, cached[1]
+                return cached[0]
+            self.changed = True
+
+        data: dict = body(r)
+        if skip == 0:
+            self.first = r
+            self.total = self._total(data)
+        results: list = data.get('results', [])
+        if self.parse:
+            results = self.parse(results)
+        if digest is not None:
+            self.fingerprint.set(skip, digest, results, self.total if skip == 0 else None)
+        return results
+
+    @classmethod
+    def _total(cls, data: dict) -> int | None:
+        for container in (data, data.get('pagination') or {}, data.get('meta') or {}):
+            for key in cls.TOTAL_KEYS:
+                if isinstance(container.get(key), int):
+                    return container[key]
+        return None
+
+    async def _window(self, skips: list[int]) -> AsyncIterator[list[dict]]:
+        semaphore: asyncio.Semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(skip: int) -> list[dict]:
+            async with semaphore:
+                return await self._page(skip)
+
+        tasks: list[asyncio.Task] = [asyncio.create_task(bounded(skip)) for skip in skips]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def pages(self) -> AsyncIterator[list[dict]]:
+        results: list[dict] = await self._page(0)
+        yield results
+        if len(results) < self.take:
+            return
+
+        if self.total is not None:
+            async for results in self._window(list(range(self.take, self.total, self.take))):
+                yield results
+            return
+
+        skip: int = self.take
+        while True:
+            skips: list[int] = [skip + i * self.take for i in range(self.concurrency)]
+            exhausted: bool = False
+            async for results in self._window(skips):
+                exhausted |= len(results) < self.take
+                if results:
+                    yield results
+            if exhausted:
+                return
+            skip = skips[-1] + self.take
+
+    async def all(self) -> list[dict]:
+        return [result async for results in self.pages() for result in results]
@@ -0,0 +1,186 @@
+import asyncio
+import dataclasses
+import json
+import os
+from functools import lru_cache
+
+from models.wtn import Offer
+from utils.log import Log, LogLevel
+
+logger = Log('Pricing', LogLevel.DEBUG)
+
+
+@lru_cache(maxsize=1024)
+def parse_size(size: str) -> float | None:
+    whole, _, fraction = size.strip().partition(' ')
+    try:
+        value: float = float(whole.replace(',', '.'))
+        if fraction:
+            numerator, denominator = fraction.split('/')
+            value += int(numerator) / int(denominator)
+        return value
+    except ValueError:
+        return None
+
+
+@dataclasses.dataclass(frozen=True)
+class Rule:
+    sku: str | None = None
+    brand: str | None = None
+    sizes: frozenset[str] | None = None
+    size_min: float | None = None
+    size_max: float | None = None
+    delta: float = 0
+    percent: float = 0
+    floor: float | None = None
+    ceiling: float | None = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Rule':
+        return cls(
+            sku=data['sku'].strip().upper() if data.get('sku') else None,
+            brand=data['brand'].strip().lower() if data.get('brand') else None,
+            sizes=frozenset(str(size) for size in data['sizes']) if data.get('sizes') else None,
+            size_min=float(data['size_min']) if data.get('size_min') is not None else None,
+            size_max=float(data['size_max']) if data.get('size_max') is not None else None,
+            delta=float(data.get('delta', 0)),
+            percent=float(data.get('percent', 0)),
+            floor=float(data['floor']) if data.get('floor') is not None else None,
+            ceiling=float(data['ceiling']) if data.get('ceiling') is not None else None,
+        )
+
+    @property
+    def ranged(self) -> bool:
+        return self.size_min is not None or self.size_max is not None
+
+    def in_range(self, size: float | None) -> bool:
+        if size is None:
+            return False
+        return (self.size_min is None or size >= self.size_min) and (self.size_max is None or size <= self.size_max)
+
+    def threshold(self, listing_price: float) -> float:
+        threshold: float = listing_price * (1 - self.percent / 100) - self.delta
+        if self.ceiling is not None:
+            threshold = min(threshold, self.ceiling)
+        if self.floor is not None:
+            threshold = max(threshold, self.floor)
+        return threshold
+
+
+class Group:
+    def __init__(self):
+        self.exact: dict[str, Rule] = {}
+        self.ranges: list[Rule] = []
+        self.any: Rule | None = None
+
+    def add(self, rule: Rule) -> None:
+        if rule.sizes is not None:
+            for size in rule.sizes:
+                self.exact.setdefault(size, rule)
+        elif rule.ranged:
+            self.ranges.append(rule)
+        elif self.any is None:
+            self.any = rule
+
+    def match(self, size: str) -> Rule | None:
+        rule: Rule | None = self.exact.get(size)
+        if rule is not None:
+            return rule
+        if self.ranges:
+            value: float | None = parse_size(size)
+            for rule in self.ranges:
+                if rule.in_range(value):
+                    return rule
+        return self.any
+
+
+class RuleSet:
+    def __init__(self, rules: list[Rule]):
+        self.size: int = len(rules)
+        self.skus: dict[str, Group] = {}
+        self.brands: dict[str, Group] = {}
+        self.default: Group = Group()
+        for rule in rules:
+            if rule.sku is not None:
+                group: Group = self.skus.setdefault(rule.sku, Group())
+            elif rule.brand is not None:
+                group: Group = self.brands.setdefault(rule.brand, Group())
+            else:
+                group: Group = self.default
+            group.add(rule)
+        self.resolved: dict[tuple[str, str, str], Rule | None] = {}
+
+    def __len__(self):
+        return self.size
+
+    def match(self, sku: str, brand: str, size: str) -> Rule | None:
+        key: tuple[str, str, str] = (sku, brand, size)
+        try:
+            return self.resolved[key]
+        except KeyError:
+            pass
+
+        rule: Rule | None = None
+        group: Group | None = self.skus.get(sku.upper())
+        if group is not None:
+            rule = group.match(size)
+        if rule is None:
+            group = self.brands.get(brand.lower())
+            if group is not None:
+                rule = group.match(size)
+        if rule is None:
+            rule = self.default.match(size)
+        self.resolved[key] = rule
+        return rule
+
+    def decide(self, offers: list[Offer], default_delta: float = 0) -> list[bool]:
+        match = self.match
+        decisions: list[bool] = []
+        for offer in offers:
+            rule: Rule | None = match(offer.sku, offer.brand, offer.size)
+            if rule is None:
+                decisions.append(offer.price >= offer.listing_price - default_delta)
+            else:
+                decisions.append(offer.price >= rule.threshold(offer.listing_price))
+        return decisions
+
+
+class PricingRules:
+    def __init__(self, path: str | None):
+        self.path: str | None = path
+        self.mtime: float | None = None
+        self.rules: RuleSet = RuleSet([])
+        self.reload()
+
+    def reload(self) -> bool:
+        if not self.path:
+            return False
+        try:
+            mtime: float = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            if self.mtime is not None:
+                logger.warning(f'Pricing rules {self.path} removed, falling back to account price delta')
+                self.rules, self.mtime = RuleSet([]), None
+            return False
+        if mtime == self.mtime:
+            return False
+
+        try:
+            with open(file=self.path, mode='r', encoding='utf-8') as f:
+                rules: RuleSet = RuleSet([Rule.from_dict(data) for data in json.load(f)])
+        except (ValueError, KeyError, TypeError, AttributeError, OSError) as e:
+            logger.error(f'Ignoring invalid pricing rules {self.path}: {e}')
+            self.mtime = mtime
+            return False
+
+        self.rules, self.mtime = rules, mtime
+        logger.info(f'Loaded {len(rules)} pricing rules from {self.path}')
+        return True
+
+    async def watch(self, interval: float = 5) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.reload()
+
+    def decide(self, offers: list[Offer], default_delta: float = 0) -> list[bool]:
+        return self.rules.decide(offers, default_delta)
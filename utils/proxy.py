@@ -1,5 +1,7 @@
+import asyncio
 import sys
-from random import choice
+import time
+from random import choice, sample
 
 from utils.log import Log, LogLevel
 
@@ -7,6 +9,12 @@ logger = Log('Proxy', LogLevel.DEBUG)
 
 
 class Proxy:
+    ALPHA: float = 0.3
+    FAILURE_THRESHOLD: int = 3
+    COOLDOWN: float = 30
+    MAX_COOLDOWN: float = 600
+    FAILURE_LATENCY: float = 5
+
     def __init__(self, hostname: str, port: int, username: str = None, password: str = None, protocol: str = 'http'):
         self.hostname = hostname
         self.port = port
@@ -14,6 +22,15 @@ class Proxy:
         self.password = password
         self.protocol = protocol
         self.validate_proxy()
+        self.url: dict[str, str] = self.get_proxy()
+
+        self.latency: float | None = None
+        self.failure_rate: float = 0
+        self.requests: int = 0
+        self.failures: int = 0
+        self.consecutive_failures: int = 0
+        self.cooldown: float = self.COOLDOWN
+        self.open_until: float = 0
 
     def validate_proxy(self):
         if not self.hostname or not isinstance(self.port, int):
@@ -28,6 +45,47 @@ class Proxy:
 
         return {'http': proxy_url, 'https': proxy_url}
 
+    @property
+    def name(self) -> str:
+        return f'{self.hostname}:{self.port}'
+
+    @property
+    def available(self) -> bool:
+        return self.open_until <= time.monotonic()
+
+    @property
+    def score(self) -> float:
+        return (self.latency or 0) * (1 + 4 * self.failure_rate)
+
+    def record(self, latency: float, ok: bool) -> None:
+        self.requests += 1
+        self.failure_rate += self.ALPHA * ((not ok) - self.failure_rate)
+        # A failure costs at least FAILURE_LATENCY, a proxy that only times out or refuses at once never scores best
+        if not ok:
+            latency = max(latency, self.FAILURE_LATENCY)
+        self.latency = latency if self.latency is None else self.latency + self.ALPHA * (latency - self.latency)
+        if ok:
+            self.consecutive_failures = 0
+            self.cooldown = self.COOLDOWN
+            return
+
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.FAILURE_THRESHOLD:
+            logger.debug(f'Quarantined {self.name} for {self.cooldown:.0f}s')
+            self.open_until = time.monotonic() + self.cooldown
+            self.cooldown = min(self.cooldown * 2, self.MAX_COOLDOWN)
+
+    def stats(self) -> dict:
+        return {
+            'proxy': self.name,
+            'latency': round(self.latency, 4) if self.latency is not None else None,
+            'failure_rate': round(self.failure_rate, 4),
+            'requests': self.requests,
+            'failures': self.failures,
+            'available': self.available,
+        }
+
     def __str__(self):
         return (
             f'Proxy('
@@ -44,7 +102,7 @@ class Proxies:
         self.path = path
         self.proxies = self.read()
 
-    def read(self) -> list[Proxy]:
+    def parse(self) -> list[Proxy]:
         proxies: list[Proxy] = []
         with open(file=self.path, mode='r', encoding='utf-8') as f:
             for line in f.readlines():
@@ -61,6 +119,10 @@ class Proxies:
                         raise ValueError("Invalid proxy format")
                 except ValueError as e:
                     logger.warning(f'{e}: {line.strip()}')
+        return proxies
+
+    def read(self) -> list[Proxy]:
+        proxies: list[Proxy] = self.parse()
         if len(proxies) == 0:
             logger.error('No proxies found', line_before=1)
             sys.exit(1)
@@ -68,10 +130,66 @@ class Proxies:
         logger.info(f'Loaded {len(proxies)} proxies', line_before=1)
         return proxies
 
-    @property
-    def random(self) -> dict[str, str]:
-        if self.proxies:
-            return choice(self.proxies).get_proxy()
-        else:
+    def reload(self) -> None:
+        try:
+            proxies: list[Proxy] = self.parse()
+        except OSError as e:
+            logger.error(f'Failed to reload proxies: {e}')
+            return
+        if len(proxies) == 0:
+            logger.error('No proxies found, keeping the current pool')
+            return
+
+        # Proxies that are still listed keep their latency and quarantine state, the list is swapped in one assignment.
+        # They are matched on their whole URL, rotated credentials or protocol on the same endpoint make a new proxy
+        current: dict[str, Proxy] = {proxy.url['http']: proxy for proxy in self.proxies}
+        self.proxies = [current.get(proxy.url['http'], proxy) for proxy in proxies]
+        kept: int = sum(proxy.url['http'] in current for proxy in proxies)
+        logger.info(f'Reloaded {len(proxies)} proxies ({len(proxies) - kept} new, {len(current) - kept} removed)')
+
+    def pick(self) -> Proxy:
+        if not self.proxies:
             logger.error('No proxies available')
             sys.exit(1)
+
+        proxies: list[Proxy] = self.proxies
+        if len(proxies) == 1:
+            return proxies[0]
+        a, b = sample(proxies, 2)
+        if a.available and b.available:
+            return a if a.score <= b.score else b
+        if a.available or b.available:
+            return a if a.available else b
+
+        available: list[Proxy] = [proxy for proxy in proxies if proxy.available]
+        if available:
+            return choice(available)
+        return min(proxies, key=lambda proxy: proxy.open_until)
+
+    async def check(self, timeout: float = 5) -> None:
+        async def check_proxy(proxy: Proxy) -> bool:
+            start: float = time.perf_counter()
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(proxy.hostname, proxy.port), timeout)
+                writer.close()
+                proxy.record(time.perf_counter() - start, True)
+                return True
+            except (OSError, asyncio.TimeoutError):
+                proxy.consecutive_failures = Proxy.FAILURE_THRESHOLD - 1
+                proxy.record(timeout, False)
+                return False
+
+        results: list[bool] = await asyncio.gather(*(check_proxy(proxy) for proxy in self.proxies))
+        logger.info(f'{sum(results)}/{len(results)} proxies reachable')
+
+    def stats(self) -> list[dict]:
+        return [proxy.stats() for proxy in sorted(self.proxies, key=lambda proxy: proxy.score, reverse=True)]
+
+    async def monitor_stats(self, interval: float = 60) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            for stats in self.stats()[:5]:
+                logger.debug(
+                    f'{stats["proxy"]}: {stats["latency"]}s latency, {stats["failure_rate"]:.0%} failures, '
+                    f'{stats["requests"]} requests{"" if stats["available"] else " (quarantined)"}'
+                )
@@ -0,0 +1,56 @@
+import asyncio
+import os
+from typing import Awaitable, Callable
+
+from models.wtn import Account
+from utils.log import Log, LogLevel
+
+logger = Log('Reload', LogLevel.DEBUG)
+
+
+def diff_accounts(
+        old: list[Account], new: list[Account]
+) -> tuple[list[Account], list[Account], list[tuple[Account, Account]]]:
+    before: dict[str, Account] = {account.email: account for account in old}
+    after: dict[str, Account] = {account.email: account for account in new}
+    added: list[Account] = [account for email, account in after.items() if email not in before]
+    removed: list[Account] = [account for email, account in before.items() if email not in after]
+    changed: list[tuple[Account, Account]] = [
+        (before[email], account) for email, account in after.items() if email in before and before[email] != account
+    ]
+    return added, removed, changed
+
+
+class FileWatcher:
+    def __init__(self, paths: list[str], interval: float = 2):
+        self.paths: list[str] = paths
+        self.interval: float = interval
+        self.mtimes: dict[str, float | None] = {path: self.mtime(path) for path in paths}
+
+    @staticmethod
+    def mtime(path: str) -> float | None:
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def poll(self) -> set[str]:
+        changed: set[str] = set()
+        for path in self.paths:
+            mtime: float | None = self.mtime(path)
+            if mtime != self.mtimes[path]:
+                self.mtimes[path] = mtime
+                changed.add(path)
+        return changed
+
+    async def watch(self, callback: Callable[[set[str]], Awaitable[None]]) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            changed: set[str] = self.poll()
+            if not changed:
+                continue
+            logger.info(f'Reloading {", ".join(sorted(changed))}')
+            try:
+                await callback(changed)
+            except Exception as e:
+                logger.error(f'Failed to reload {", ".join(sorted(changed))}: {e}')
@@ -0,0 +1,140 @@
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, TypeVar
+
+from utils.log import Log
+from utils.metrics import endpoint
+
+T = TypeVar('T')
+
+# Proxy failures are retried too, the next attempt picks another proxy
+PROXY_FAILURE_CODES: set[int] = {403, 407, 429, 502, 503, 504}
+RETRYABLE_CODES: set[int] = {408, 425, 500} | PROXY_FAILURE_CODES
+
+
+class RequestError(Exception):
+    retryable: bool = True
+
+
+class RequestTimeout(RequestError):
+    pass
+
+
+class ProxyError(RequestError):
+    pass
+
+
+class HttpError(RequestError):
+    def __init__(self, status_code: int, message: str | None = None):
+        super().__init__(message or f'Unexpected status code: {status_code}')
+        self.status_code: int = status_code
+        self.retryable = status_code in RETRYABLE_CODES
+
+
+class Unauthorized(HttpError):
+    def __init__(self, message: str | None = None):
+        super().__init__(401, message)
+
+
+class Deadline(RequestError):
+    retryable = False
+
+
+def classify(e: Exception, transport: bool = False) -> Exception:
+    if isinstance(e, RequestError):
+        return e
+    # The TLS client reports every transport failure with the same exception type, only the message tells them apart
+    message: str = str(e)
+    if isinstance(e, TimeoutError) or 'Client.Timeout exceeded' in message:
+        return RequestTimeout(message or 'Request timed out')
+    if 'Proxy responded with non 200 code' in message or 'proxyconnect' in message:
+        return ProxyError(message)
+    if transport or isinstance(e, ConnectionError):
+        return RequestError(message)
+    return e
+
+
+def expect(status_code: int, *expected: int, message: str | None = None) -> None:
+    if status_code not in expected:
+        raise Unauthorized(message) if status_code == 401 else HttpError(status_code, message)
+
+
+class RetryBudget:
+    def __init__(self, ratio: float = 0.2, reserve: float = 10):
+        self.ratio: float = ratio
+        self.reserve: float = reserve
+        self.balance: float = reserve
+
+    def deposit(self) -> None:
+        self.balance = min(self.reserve, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.balance < 1:
+            return False
+        self.balance -= 1
+        return True
+
+
+class RetryPolicy:
+    def __init__(self, attempts: int = 5, base: float = 0.5, cap: float = 30, ratio: float = 0.2, reserve: float = 10):
+        self.attempts: int = attempts
+        self.base: float = base
+        self.cap: float = cap
+        self.ratio: float = ratio
+        self.reserve: float = reserve
+        self.budgets: dict[str, RetryBudget] = {}
+
+    def budget(self, url: str) -> RetryBudget:
+        path: str = endpoint(url)
+        budget: RetryBudget | None = self.budgets.get(path)
+        if budget is None:
+            budget = self.budgets[path] = RetryBudget(self.ratio, self.reserve)
+        return budget
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    async def run(
+            self, func: Callable[[], Awaitable[T]], url: str, deadline: float | None = None, log: Log | None = None
+    ) -> T:
+        budget: RetryBudget = self.budget(url)
+        budget.deposit()
+        attempt: int = 0
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise Deadline(f'Deadline exceeded for {endpoint(url)}')
+            try:
+                return await func()
+            except Exception as e:
+                error: Exception = classify(e)
+                attempt += 1
+                delay: float = self.backoff(attempt)
+                if not self._should_retry(error, attempt, delay, deadline, budget, url, log):
+                    if error is e:
+                        raise
+                    raise error from e
+                if log is not None:
+                    log.warning(
+                        '%s: %s, retrying in %.1fs (%d/%d)', type(error).__name__, error, delay, attempt, self.attempts
+                    )
+            await asyncio.sleep(delay)
+
+    def _should_retry(
+            self, error: Exception, attempt: int, delay: float, deadline: float | None, budget: RetryBudget,
+            url: str, log: Log | None
+    ) -> bool:
+        if not isinstance(error, RequestError) or not error.retryable or attempt >= self.attempts:
+            return False
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return False
+        if not budget.withdraw():
+            if log is not None:
+                log.debug('Retry budget of %s exhausted', endpoint(url))
+            return False
+        return True
+
+
+DEFAULT_POLICY: RetryPolicy = RetryPolicy()
+LOGIN_POLICY: RetryPolicy = RetryPolicy(attempts=5, base=1, cap=30, ratio=1, reserve=20)
+ACTION_POLICY: RetryPolicy = RetryPolicy(attempts=3, base=0.2, cap=2)
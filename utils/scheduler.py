@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from utils.metrics import POLL_INTERVAL
+
+
+class PollScheduler:
+    ALPHA: float = 0.2
+    SMOOTHING: float = 0.5
+    CACHE_PENALTY: float = 1.1
+
+    def __init__(
+            self,
+            delay: float,
+            min_delay: float | None = None,
+            max_delay: float | None = None,
+            phase: float = 0,
+            name: str = 'monitor'
+    ):
+        self.name: str = name
+        self.delay: float = delay
+        self.min_delay: float = min(min_delay or delay, delay)
+        self.max_delay: float = max(max_delay or delay, delay)
+        self.phase: float = phase % 1
+
+        self.interval: float = delay
+        self.next_tick: float | None = None
+        self.change_rate: float = 0
+        self.error_rate: float = 0
+
+    def configure(self, delay: float, min_delay: float | None = None, max_delay: float | None = None) -> None:
+        self.delay = delay
+        self.min_delay = min(min_delay or delay, delay)
+        self.max_delay = max(max_delay or delay, delay)
+        self.interval = min(max(self.interval, self.min_delay), self.max_delay)
+
+    async def wait(self) -> None:
+        now: float = time.monotonic()
+        if self.next_tick is None:
+            self.next_tick = now + self.interval * self.phase
+        else:
+            previous_tick: float = self.next_tick
+            self.next_tick = max(self.next_tick + self.interval, now)
+            POLL_INTERVAL.observe(self.next_tick - previous_tick, self.name)
+        await asyncio.sleep(self.next_tick - now)
+
+    def feedback(self, changed: bool = False, error: bool = False, cached: bool = False) -> None:
+        self.change_rate += self.ALPHA * (changed - self.change_rate)
+        self.error_rate += self.ALPHA * (error - self.error_rate)
+
+        target: float = (
+                self.delay
+                - (self.delay - self.min_delay) * self.change_rate
+                + (self.max_delay - self.delay) * self.error_rate
+        )
+        if cached:
+            target *= self.CACHE_PENALTY
+
+        self.interval += (target - self.interval) * self.SMOOTHING
+        if changed:
+            self.interval = min(self.interval, target)
+        self.interval = min(max(self.interval, self.min_delay), self.max_delay)
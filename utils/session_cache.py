@@ -0,0 +1,55 @@
+import base64
+import hashlib
+import json
+import os
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from utils.log import Log, LogLevel
+
+logger = Log('Session', LogLevel.DEBUG)
+
+KDF_ITERATIONS: int = 200_000
+
+
+class SessionCache:
+    def __init__(self, directory: str, email: str, password: str):
+        self.directory: str = directory
+        self.email: str = email
+        self.password: str = password
+        self.path: str = os.path.join(directory, f'{hashlib.sha256(email.encode()).hexdigest()[:16]}.bin')
+        self.fernet: Fernet | None = None
+
+    def _get_fernet(self) -> Fernet:
+        if self.fernet is None:
+            key: bytes = hashlib.pbkdf2_hmac(
+                'sha256', self.password.encode(), f'wethetoolbox:{self.email}'.encode(), KDF_ITERATIONS
+            )
+            self.fernet = Fernet(base64.urlsafe_b64encode(key))
+        return self.fernet
+
+    def load(self) -> dict | None:
+        try:
+            with open(file=self.path, mode='rb') as f:
+                return json.loads(self._get_fernet().decrypt(f.read()))
+        except FileNotFoundError:
+            return None
+        except (InvalidToken, ValueError, OSError) as e:
+            logger.warning(f'Ignoring unreadable session cache {self.path}: {type(e).__name__}')
+            return None
+
+    def save(self, data: dict) -> None:
+        tmp_path: str = f'{self.path}.tmp'
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(file=tmp_path, mode='wb') as f:
+                f.write(self._get_fernet().encrypt(json.dumps(data).encode()))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f'Error while saving session cache: {e}')
+
+    def clear(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,147 @@
+import dataclasses
+import json
+import sqlite3
+import threading
+import time
+from queue import SimpleQueue, Empty
+
+from models.wtn import Consign
+from utils.log import Log, LogLevel
+
+logger = Log('Store', LogLevel.DEBUG)
+
+SCHEMA: str = '''
+CREATE TABLE IF NOT EXISTS slots (
+    id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS offers (
+    id TEXT PRIMARY KEY,
+    task INTEGER,
+    status TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS actions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    task INTEGER,
+    outcome TEXT NOT NULL,
+    detail TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS actions_key ON actions (kind, key, outcome);
+'''
+
+UPSERT_SLOT: str = 'INSERT OR REPLACE INTO slots (id, data, updated_at) VALUES (?, ?, ?)'
+
+SUCCESS: str = 'success'
+FAILURE: str = 'failure'
+
+
+class StateStore:
+    BATCH_SIZE: int = 500
+
+    def __init__(self, path: str = 'state.db'):
+        self.path: str = path
+        self.queue: SimpleQueue = SimpleQueue()
+
+        connection: sqlite3.Connection = self._connect()
+        try:
+            self.slots: list[dict] = [json.loads(data) for data, in connection.execute('SELECT data FROM slots')]
+            self.offers: dict[str, str] = dict(connection.execute('SELECT id, status FROM offers'))
+            self.succeeded: set[tuple[str, str]] = set(
+                connection.execute('SELECT DISTINCT kind, key FROM actions WHERE outcome = ?', (SUCCESS,))
+            )
+        finally:
+            connection.close()
+        logger.debug(f'Loaded {len(self.slots)} slots and {len(self.offers)} offers from {path}')
+
+        self.thread: threading.Thread = threading.Thread(target=self._run, name='state-store', daemon=True)
+        self.thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection: sqlite3.Connection = sqlite3.connect(self.path)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(SCHEMA)
+        return connection
+
+    def _run(self) -> None:
+        connection: sqlite3.Connection = self._connect()
+        running: bool = True
+        while running:
+            batch: list = [self.queue.get()]
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+
+            done: list[threading.Event] = []
+            try:
+                with connection:
+                    for item in batch:
+                        if isinstance(item, threading.Event):
+                            done.append(item)
+                        elif item is None:
+                            running = False
+                        elif callable(item):
+                            item(connection)
+                        else:
+                            connection.execute(*item)
+            except sqlite3.Error as e:
+                logger.error(f'Error while writing state: {e}')
+            for event in done:
+                event.set()
+        connection.close()
+
+    @staticmethod
+    def _slot_rows(slots: list[Consign]) -> list[tuple[int, str, float]]:
+        now: float = time.time()
+        return [(slot.id, json.dumps(dataclasses.asdict(slot)), now) for slot in slots]
+
+    def save_slots(self, slots: list[Consign]) -> None:
+        # One queue item is one transaction, a crash never leaves a partial table to resume from
+        def write(connection: sqlite3.Connection) -> None:
+            connection.execute('DELETE FROM slots')
+            connection.executemany(UPSERT_SLOT, self._slot_rows(slots))
+
+        self.queue.put(write)
+
+    def update_slots(self, upserted: list[Consign], removed: list[int]) -> None:
+        # Slots are serialised by the writer thread, never on the event loop
+        def write(connection: sqlite3.Connection) -> None:
+            connection.executemany('DELETE FROM slots WHERE id = ?', [(c_id,) for c_id in removed])
+            connection.executemany(UPSERT_SLOT, self._slot_rows(upserted))
+
+        self.queue.put(write)
+
+    def record_offer(self, offer_id: str, task: int | None, status: str) -> None:
+        self.offers[offer_id] = status
+        self.queue.put((
+            'INSERT OR REPLACE INTO offers (id, task, status, updated_at) VALUES (?, ?, ?, ?)',
+            (offer_id, task, status, time.time())
+        ))
+
+    def record_action(self, kind: str, key: str, task: int | None, outcome: str, detail: str = '') -> None:
+        if outcome == SUCCESS:
+            self.succeeded.add((kind, key))
+        self.queue.put((
+            'INSERT INTO actions (kind, key, task, outcome, detail, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (kind, key, task, outcome, detail, time.time())
+        ))
+
+    def has_succeeded(self, kind: str, key: str) -> bool:
+        return (kind, key) in self.succeeded
+
+    def flush(self, timeout: float = 5) -> None:
+        done: threading.Event = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def close(self) -> None:
+        self.flush()
+        self.queue.put(None)
+        self.thread.join(timeout=5)
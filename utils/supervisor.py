@@ -0,0 +1,209 @@
+import asyncio
+import copy
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import zlib
+from multiprocessing.connection import Connection
+from typing import Callable
+
+from models.wtn import Account
+from utils.config import Config
+from utils.log import Log, LogLevel
+from utils.reload import FileWatcher
+
+logger = Log('Supervisor', LogLevel.DEBUG)
+
+RESTART_DELAY: float = 5
+MAX_RESTART_DELAY: float = 300
+STABLE_AFTER: float = 60
+OUTBOX_SIZE: int = 1000
+
+
+def suffixed(path: str, index: int) -> str:
+    root, ext = os.path.splitext(path)
+    return f'{root}.{index}{ext}'
+
+
+def owner(account: Account, workers: int) -> int:
+    # Accounts are assigned by hash so that every worker agrees on accounts added later without asking the supervisor
+    return zlib.crc32(account.email.encode()) % workers
+
+
+def split(accounts: list[Account], workers: int) -> list[list[tuple[int, Account]]]:
+    shards: list[list[tuple[int, Account]]] = [[] for _ in range(workers)]
+    for task, account in enumerate(accounts, start=1):
+        shards[owner(account, workers)].append((task, account))
+    return shards
+
+
+def shard_config(config: Config, index: int, workers: int) -> Config:
+    shard: Config = copy.copy(config)
+    shard.workers = workers
+    if config.metrics_port:
+        shard.metrics_port = config.metrics_port + index
+    if config.control_port:
+        shard.control_port = config.control_port + index
+    if config.metrics_file:
+        shard.metrics_file = suffixed(config.metrics_file, index)
+    if config.log_file:
+        shard.log_file = suffixed(config.log_file, index)
+    if config.capture_file:
+        shard.capture_file = suffixed(config.capture_file, index)
+    # Workers never share a file they write to, SQLite and the variant cache would lose each other's updates
+    shard.state_db = suffixed(config.state_db, index)
+    shard.variant_cache = suffixed(config.variant_cache, index)
+    return shard
+
+
+class Worker:
+    def __init__(
+            self, index: int, config: Config, accounts: list[tuple[int, Account]], target: Callable, poller: bool
+    ):
+        self.index: int = index
+        self.config: Config = config
+        self.accounts: list[tuple[int, Account]] = accounts
+        self.target: Callable = target
+        self.poller: bool = poller
+
+        self.process: multiprocessing.Process | None = None
+        self.conn: Connection | None = None
+        self.started_at: float = 0
+        self.restart_at: float | None = None
+        self.restart_delay: float = RESTART_DELAY
+        self.outbox: queue.Queue[bytes] = queue.Queue(maxsize=OUTBOX_SIZE)
+        self.sender: threading.Thread | None = None
+        self.dropping: bool = False
+
+    def start(self, context) -> None:
+        # Events queued for the previous process are stale by the time this one has logged in
+        while not self.outbox.empty():
+            self.outbox.get_nowait()
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=self.target,
+            args=(self.index, self.config, self.accounts, child, self.poller),
+            name=f'worker-{self.index}'
+        )
+        self.process.start()
+        child.close()
+        if self.sender is None:
+            self.sender = threading.Thread(target=self._send, name=f'relay-{self.index}', daemon=True)
+            self.sender.start()
+        self.started_at, self.restart_at = time.monotonic(), None
+        logger.info(f'Worker {self.index} started with {len(self.accounts)} accounts (pid {self.process.pid})')
+
+    def send_bytes(self, data: bytes) -> None:
+        # Never blocks the supervisor, a worker that stopped reading its pipe only loses its own events
+        if self.conn is None:
+            return
+        try:
+            self.outbox.put_nowait(data)
+            self.dropping = False
+        except queue.Full:
+            if not self.dropping:
+                logger.warning(f'Worker {self.index} is not reading consign events, dropping them')
+            self.dropping = True
+
+    def _send(self) -> None:
+        while True:
+            data: bytes = self.outbox.get()
+            try:
+                self.conn.send_bytes(data)
+            except (AttributeError, OSError, ValueError):
+                pass
+
+    def interrupt(self) -> None:
+        if self.process is not None and self.process.is_alive():
+            try:
+                os.kill(self.process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def stop(self, timeout: float = 15) -> None:
+        # Workers get to flush their webhooks, state and logs, only the ones that don't exit in time are killed
+        if self.process is not None and self.process.is_alive():
+            self.process.join(timeout)
+            if self.process.is_alive():
+                logger.warning(f'Worker {self.index} did not stop in {timeout:.0f}s, killing it')
+                self.process.kill()
+                self.process.join(5)
+        if self.conn is not None:
+            self.conn.close()
+
+
+class Supervisor:
+    def __init__(self, config: Config, workers: int, target: Callable):
+        self.config: Config = config
+        workers = max(1, min(workers, len(config.accounts)))
+        shards: list[list[tuple[int, Account]]] = split(config.accounts, workers)
+        # Shards can come out empty, the first one with accounts polls consignment slots for everyone
+        self.poller: int = next(index for index, accounts in enumerate(shards) if accounts)
+        self.context = multiprocessing.get_context('spawn')
+        self.workers: list[Worker] = [
+            Worker(index, shard_config(config, index, workers), shards[index], target, index == self.poller)
+            for index in range(workers)
+        ]
+
+    async def run(self) -> None:
+        for worker in self.workers:
+            if worker.accounts:
+                worker.start(self.context)
+        try:
+            await asyncio.gather(
+                self.relay(), self.watch(), FileWatcher(['.env', 'accounts.csv']).watch(self.reload)
+            )
+        finally:
+            for worker in self.workers:
+                worker.interrupt()
+            for worker in self.workers:
+                worker.stop()
+
+    async def reload(self, changed: set[str]) -> None:
+        # Workers apply the change themselves, this only keeps what a restarted worker is given in sync with them
+        config: Config | None = Config.reload(self.config)
+        if config is None:
+            return
+        self.config = config
+        shards: list[list[tuple[int, Account]]] = split(config.accounts, len(self.workers))
+        for worker in self.workers:
+            worker.config = shard_config(config, worker.index, len(self.workers))
+            worker.accounts = shards[worker.index]
+            if worker.accounts and worker.process is None:
+                worker.start(self.context)
+
+    async def relay(self) -> None:
+        # The poller publishes consignment slot events, the others only place consignments
+        while True:
+            poller: Worker = self.workers[self.poller]
+            try:
+                data: bytes = await asyncio.to_thread(poller.conn.recv_bytes)
+            except (AttributeError, EOFError, OSError):
+                await asyncio.sleep(1)
+                continue
+            for worker in self.workers:
+                if worker is not poller:
+                    worker.send_bytes(data)
+
+    async def watch(self, interval: float = 1) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            now: float = time.monotonic()
+            for worker in self.workers:
+                if worker.process is None or worker.process.is_alive():
+                    continue
+                if worker.restart_at is None:
+                    if now - worker.started_at >= STABLE_AFTER:
+                        worker.restart_delay = RESTART_DELAY
+                    worker.restart_at = now + worker.restart_delay
+                    worker.conn.close()
+                    logger.error(
+                        f'Worker {worker.index} exited with code {worker.process.exitcode}, '
+                        f'restarting in {worker.restart_delay:.0f}s'
+                    )
+                    worker.restart_delay = min(worker.restart_delay * 2, MAX_RESTART_DELAY)
+                elif now >= worker.restart_at:
+                    worker.start(self.context)
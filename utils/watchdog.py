@@ -0,0 +1,129 @@
+import asyncio
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from types import FrameType
+
+from utils.log import Log, LogLevel
+from utils.metrics import LOOP_LAG, LOOP_STALLS
+
+logger = Log('Watchdog', LogLevel.DEBUG)
+
+
+def fold(frame: FrameType | None, thread: str) -> str:
+    names: list[str] = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    names.append(thread)
+    return ';'.join(reversed(names))
+
+
+class Watchdog:
+    def __init__(self, threshold: float = 0.25, interval: float = 0.05):
+        self.threshold: float = threshold
+        self.interval: float = interval
+        self.beat: float = time.monotonic()
+        self.loop_thread: int | None = None
+        self.running: bool = False
+
+    async def run(self) -> None:
+        # The loop only proves it is alive by ticking, a separate thread notices when it stops and grabs its stack
+        self.loop_thread = threading.get_ident()
+        self.running = True
+        threading.Thread(target=self._watch, name='watchdog', daemon=True).start()
+        try:
+            while True:
+                start: float = time.monotonic()
+                await asyncio.sleep(self.interval)
+                self.beat = time.monotonic()
+                LOOP_LAG.observe(self.beat - start - self.interval)
+        finally:
+            self.running = False
+
+    def _watch(self) -> None:
+        reported: float | None = None
+        while self.running:
+            time.sleep(self.interval)
+            beat: float = self.beat
+            lag: float = time.monotonic() - beat - self.interval
+            if lag < self.threshold or reported == beat:
+                continue
+            reported = beat
+            LOOP_STALLS.inc()
+            frame: FrameType | None = sys._current_frames().get(self.loop_thread)
+            stack: str = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+            logger.warning(f'Event loop blocked for {lag:.2f}s in:\n{stack.rstrip()}')
+
+
+class Profiler:
+    def __init__(self, interval: float = 0.005):
+        self.interval: float = interval
+        self.thread: threading.Thread | None = None
+
+    def start(self, seconds: float) -> str | None:
+        if self.thread is not None and self.thread.is_alive():
+            logger.warning('A profile is already running')
+            return None
+        path: str = os.path.abspath(f'profile-{os.getpid()}-{int(time.time())}.folded')
+        self.thread = threading.Thread(target=self._sample, args=(seconds, path), name='profiler', daemon=True)
+        self.thread.start()
+        logger.info(f'Profiling for {seconds:g}s into {path}')
+        return path
+
+    def _sample(self, seconds: float, path: str) -> None:
+        # Folded stacks, one "thread;file:function;... count" line per stack, as read by flamegraph.pl and speedscope
+        stacks: dict[str, int] = {}
+        own: int = threading.get_ident()
+        deadline: float = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names: dict[int, str] = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    stack: str = fold(frame, names.get(ident, str(ident)))
+                    stacks[stack] = stacks.get(stack, 0) + 1
+            time.sleep(self.interval)
+        try:
+            with open(file=path, mode='w', encoding='utf-8') as f:
+                f.writelines(f'{stack} {count}\n' for stack, count in sorted(stacks.items()))
+        except OSError as e:
+            logger.error(f'Error while writing profile: {e}')
+            return
+        logger.info(f'Wrote {sum(stacks.values())} samples to {path}')
+
+    def install(self, seconds: float) -> None:
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.start, seconds)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            logger.debug('SIGUSR1 is not available, use the control port to profile')
+
+    async def serve(self, port: int, seconds: float, host: str = '127.0.0.1') -> None:
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            try:
+                command, _, argument = (await reader.readline()).decode().strip().partition(' ')
+                if command == 'profile':
+                    path: str | None = self.start(float(argument or seconds))
+                    reply: str = path or 'A profile is already running'
+                elif command == 'stacks':
+                    names: dict[int, str] = {thread.ident: thread.name for thread in threading.enumerate()}
+                    reply = '\n'.join(
+                        f'{names.get(ident, ident)}:\n{"".join(traceback.format_stack(frame)).rstrip()}'
+                        for ident, frame in sys._current_frames().items()
+                    )
+                else:
+                    reply = 'Commands: profile [seconds], stacks'
+                writer.write(f'{reply}\n'.encode())
+                await writer.drain()
+            except (ConnectionError, ValueError) as e:
+                logger.debug(f'Invalid control command: {e}')
+            finally:
+                writer.close()
+
+        server: asyncio.Server = await asyncio.start_server(handle, host, port)
+        logger.info(f'Control port listening on {host}:{port}')
+        async with server:
+            await server.serve_forever()
@@ -1,14 +1,17 @@
+import asyncio
 import dataclasses
-import json
 from datetime import datetime
 
-from requests import post
+import httpx
 
 from models.wtn import Offer, Consign, Product
 from utils.log import Log, LogLevel
 
 logger: Log = Log('Webhook', LogLevel.DEBUG)
 
+USERNAME: str = 'WeTheToolbox'
+AVATAR_URL: str = 'https://s3-eu-west-1.amazonaws.com/tpd/logos/5c741846c666770001962f39/0x0.png'
+
 
 @dataclasses.dataclass
 class Footer:
@@ -32,10 +35,97 @@ class Embed:
     footer: Footer = dataclasses.field(default_factory=Footer)
 
 
+class Dispatcher:
+    MAX_EMBEDS: int = 10
+    LINGER: float = 0.25
+    FLUSH_TIMEOUT: float = 10
+
+    _client: httpx.AsyncClient | None = None
+    _instances: dict[str, 'Dispatcher'] = {}
+
+    def __init__(self, webhook_url: str):
+        self.webhook_url: str = webhook_url
+        self.queue: asyncio.Queue[dict] = asyncio.Queue()
+        self.task: asyncio.Task | None = None
+
+    @classmethod
+    def get(cls, webhook_url: str) -> 'Dispatcher':
+        if webhook_url not in cls._instances:
+            cls._instances[webhook_url] = cls(webhook_url)
+        return cls._instances[webhook_url]
+
+    @classmethod
+    def client(cls) -> httpx.AsyncClient:
+        if cls._client is None:
+            cls._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(10),
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+                headers={'Content-Type': 'application/json'},
+            )
+        return cls._client
+
+    def put(self, embed: dict) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._run())
+        self.queue.put_nowait(embed)
+
+    async def _run(self) -> None:
+        while True:
+            embeds: list[dict] = [await self.queue.get()]
+            await asyncio.sleep(self.LINGER)
+            while len(embeds) < self.MAX_EMBEDS and not self.queue.empty():
+                embeds.append(self.queue.get_nowait())
+
+            try:
+                await self._post(embeds)
+            except Exception as e:
+                logger.error(f'Error while sending webhook: {e}')
+            finally:
+                for _ in embeds:
+                    self.queue.task_done()
+
+    async def _post(self, embeds: list[dict]) -> None:
+        payload: dict = {'embeds': embeds, 'username': USERNAME, 'avatar_url': AVATAR_URL}
+        while True:
+            r: httpx.Response = await self.client().post(self.webhook_url, json=payload)
+            if r.status_code == 429:
+                retry_after: float = self._retry_after(r)
+                logger.warning(f'Webhook rate limited, retrying in {retry_after:.2f}s')
+                await asyncio.sleep(retry_after)
+                continue
+            if r.status_code >= 400:
+                logger.error(f'Error while sending webhook: {r.status_code}')
+            elif r.headers.get('X-RateLimit-Remaining') == '0':
+                await asyncio.sleep(float(r.headers.get('X-RateLimit-Reset-After', 0)))
+            return
+
+    @staticmethod
+    def _retry_after(r: httpx.Response) -> float:
+        try:
+            return float(r.json()['retry_after'])
+        except Exception:
+            return float(r.headers.get('Retry-After') or r.headers.get('X-RateLimit-Reset-After') or 1)
+
+    async def close(self) -> None:
+        if self.task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=self.FLUSH_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f'Dropped {self.queue.qsize()} webhooks on shutdown')
+        self.task.cancel()
+
+    @classmethod
+    async def close_all(cls) -> None:
+        await asyncio.gather(*(d.close() for d in cls._instances.values()), return_exceptions=True)
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+
+
 class WebHook:
     def __init__(self, webhook_url: str):
         self.webhook_url = webhook_url
-        self.webhook_headers = {'Content-Type': 'application/json'}
         self.default_embed = Embed()
 
     @staticmethod
@@ -45,14 +135,13 @@ class WebHook:
         embed_dict['thumbnail'] = dataclasses.asdict(embed.thumbnail)
         return embed_dict
 
+    @staticmethod
+    async def close() -> None:
+        await Dispatcher.close_all()
+
     def send(self, embed: Embed) -> None:
         embed = embed or self.default_embed
-        webhook_data = {'embeds': [self._embed_to_dict(embed)]}
-
-        try:
-            post(self.webhook_url, headers=self.webhook_headers, data=json.dumps(webhook_data))
-        except Exception as e:
-            logger.error(f'Error while sending webhook: {e}')
+        self._send_webhook({'embeds': [self._embed_to_dict(embed)]})
 
     def _build_webhook_data(
             self, image: str | None, title: str, color: int, fields: list[dict], pid: int = None
@@ -74,15 +163,16 @@ class WebHook:
                     }
                 }
             ],
-            'username': 'WeTheToolbox',
-            'avatar_url': 'https://s3-eu-west-1.amazonaws.com/tpd/logos/5c741846c666770001962f39/0x0.png'
+            'username': USERNAME,
+            'avatar_url': AVATAR_URL
         }
 
     def _send_webhook(self, webhook_data: dict) -> None:
-        try:
-            post(self.webhook_url, headers=self.webhook_headers, data=json.dumps(webhook_data))
-        except Exception as e:
-            logger.error(f'Error while sending webhook: {e}')
+        if not self.webhook_url:
+            return
+        dispatcher: Dispatcher = Dispatcher.get(self.webhook_url)
+        for embed in webhook_data['embeds']:
+            dispatcher.put(embed)
 
     def send_offer(self, offer: Offer) -> None:
         fields: list[dict] = [